@@ -0,0 +1,14 @@
+import os
+
+# Settings `config` needs, pointing at the fake PostgREST backend
+FAKE_ENV = {
+    "DB_URL": "http://fake-postgrest",
+    "DB_KEY": "benchmark",
+    "SECRET_KEY": "benchmark-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "15",
+    "REFRESH_TOKEN_EXPIRE_DAYS": "30",
+}
+
+for name, value in FAKE_ENV.items():
+    os.environ.setdefault(name, value)
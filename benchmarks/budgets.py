@@ -0,0 +1,136 @@
+"""Database round-trip budgets per endpoint.
+
+Replays a fixed sequence of requests against `FakePostgrest` and fails
+(exit status 1) when one makes more PostgREST calls than its budget, so a
+new N+1 pattern or an extra lookup is caught before it ships. A request
+answering with another status than expected fails too, so an error
+response can't pass for a cheap one:
+
+    python -m benchmarks.budgets
+
+Budgets are upper bounds; lower one when an endpoint gets cheaper.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import timedelta
+
+import httpx
+
+from benchmarks.fake_postgrest import FakePostgrest, install
+from benchmarks.run import API_KEY, DOMAIN, EMAIL, PASSWORD, START, make_events, seed
+
+# (name, budget, expected status, method, path, request kind), run in this
+# order: login provides the token later dashboard requests use
+SCENARIOS = [
+    ("track, key not cached", 2, 202, "POST", "/events/track", "track"),
+    ("track, key cached", 0, 202, "POST", "/events/track", "track"),
+    ("beacon, key cached", 0, 204, "POST", "/events/beacon", "beacon"),
+    ("login", 2, 201, "POST", "/auth/login", "login"),
+    ("refresh", 1, 201, "POST", "/auth/refresh", None),
+    ("events page", 1, 200, "GET", "/events/", "dashboard"),
+    ("analytics summary", 1, 200, "GET", "/analytics/summary", "summary"),
+    ("analytics timeseries", 1, 200, "GET", "/analytics/timeseries", "summary"),
+    ("analytics uniques", 1, 200, "GET", "/analytics/uniques", "summary"),
+    ("analytics paths", 1, 200, "GET", "/analytics/paths", "summary"),
+    ("analytics funnel", 1, 200, "GET", "/analytics/paths/funnel", "funnel"),
+    ("domains, not cached", 1, 200, "GET", "/domains/", None),
+    ("domains, cached", 0, 200, "GET", "/domains/", None),
+    ("logout all", 1, 201, "POST", "/auth/logout-all", "dashboard"),
+]
+
+
+async def run(latency: float) -> list:
+    from core.dbtrace import TooManyQueries, max_queries
+    from main import app
+
+    fake = install(FakePostgrest(latency=latency))
+    seed(fake, make_events(5, 10))
+
+    batch = make_events(1, 5)
+    for event in batch:
+        event.pop("domain_id")
+        event.pop("user_id")
+
+    end = START + timedelta(days=1)
+    access = {}
+
+    def request(kind: str | None) -> dict:
+        dashboard = {"Authorization": f"Bearer {access.get('token')}"}
+        period = {"domain": DOMAIN, "start": START.isoformat(), "end": end.isoformat()}
+        return {
+            "track": {"json": batch, "headers": {"Authorization": f"Bearer {API_KEY}"}},
+            "beacon": {
+                "content": json.dumps({"key": API_KEY, "events": batch}),
+                "headers": {"Content-Type": "text/plain"},
+            },
+            "login": {"data": {"username": EMAIL, "password": PASSWORD}},
+            "dashboard": {"headers": dashboard},
+            "summary": {"params": period, "headers": dashboard},
+            "funnel": {
+                "params": {**period, "steps": ["/", "/pricing"]},
+                "headers": dashboard,
+            },
+        }.get(kind, {})
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    # https, the refresh cookie is `secure`
+    async with httpx.AsyncClient(
+        transport=transport, base_url="https://bench"
+    ) as client:
+        for name, budget, expected, method, path, kind in SCENARIOS:
+            error = response = None
+            try:
+                with max_queries(budget, name) as calls:
+                    response = await client.request(method, path, **request(kind))
+            except TooManyQueries as e:
+                error = str(e)
+
+            status = response.status_code if response is not None else None
+            if error is None and status != expected:
+                error = f"{name}: expected status {expected}, got {status}"
+
+            if kind == "login" and status == expected:
+                access.update(response.json())
+
+            results.append(
+                {
+                    "name": name,
+                    "request": f"{method} {path}",
+                    "status": status,
+                    "expected_status": expected,
+                    "calls": len(calls),
+                    "budget": budget,
+                    "queries": [repr(call) for call in calls],
+                    "error": error,
+                }
+            )
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per fake DB call"
+    )
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.latency))
+    for result in results:
+        mark = "FAIL" if result["error"] else "ok"
+        print(
+            f"{mark:4}  {result['calls']}/{result['budget']}  "
+            f"{result['status']}  {result['name']} ({result['request']})"
+        )
+        if result["error"]:
+            print(result["error"])
+
+    sys.exit(1 if any(result["error"] for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Cold-start benchmark: import time and first responses of a fresh worker.
+
+Every run starts a new interpreter, as a scale-from-zero instance would,
+and records how long `import main` takes and the latency of the first
+`GET /` and `POST /events/track` (with the API key still uncached), plus a
+second, warm `POST /events/track` for comparison:
+
+    python -m benchmarks.cold_start --runs 10 --latency 0.005 --out cold.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+def child(latency: float):
+    """One cold worker, prints its timings as JSON"""
+    import benchmarks  # noqa: F401 - sets the fake settings
+
+    started = time.perf_counter()
+    import main
+
+    timings = {"import": time.perf_counter() - started}
+
+    import asyncio
+
+    import httpx
+
+    from benchmarks.fake_postgrest import FakePostgrest, install
+    from benchmarks.run import API_KEY, make_events, seed
+
+    seed(install(FakePostgrest(latency=latency)))
+    batch = make_events(1, 20)
+    for event in batch:
+        event.pop("domain_id")
+        event.pop("user_id")
+
+    async def requests():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for name, send in (
+                ("first_root", lambda: client.get("/")),
+                (
+                    "first_track",
+                    lambda: client.post(
+                        "/events/track",
+                        json=batch,
+                        headers={"Authorization": f"Bearer {API_KEY}"},
+                    ),
+                ),
+                (
+                    "warm_track",
+                    lambda: client.post(
+                        "/events/track",
+                        json=batch,
+                        headers={"Authorization": f"Bearer {API_KEY}"},
+                    ),
+                ),
+            ):
+                started = time.perf_counter()
+                response = await send()
+                timings[name] = time.perf_counter() - started
+                response.raise_for_status()
+
+    asyncio.run(requests())
+    main.event_writer.stop()
+    # Modules loaded by the end, to spot heavy imports creeping back in
+    timings["modules"] = len(sys.modules)
+    json.dump(timings, sys.stdout)
+
+
+def run(runs: int, latency: float) -> list:
+    samples = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.cold_start", "--child"]
+            + ["--latency", str(latency)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        wall = time.perf_counter() - started
+
+        timings = json.loads(output)
+        timings["process"] = wall
+        for name, value in timings.items():
+            samples.setdefault(name, []).append(value)
+
+    from benchmarks.run import summarize
+
+    modules = samples.pop("modules")
+    return [
+        summarize(name, "cold_start", values, modules=max(modules))
+        for name, values in samples.items()
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per fake DB call"
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.latency)
+        return
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "runs": args.runs,
+        "results": run(args.runs, args.latency),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""In-memory stand-in for the Supabase PostgREST API.
+
+`FakePostgrest` is an httpx transport, so the real postgrest query builders
+used by `database.db()` and `database.adb()` run unchanged against it.
+It understands the subset of PostgREST the app uses: column filters,
+`or=(...)`, `order`, `limit`/`offset`, single-object responses, inserts,
+upserts on a conflict column, updates, deletes and registered RPCs.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+TABLES = ("events", "sessions", "domains", "api_keys", "users", "tokens")
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "is": lambda a, b: a is b,
+}
+RESERVED_PARAMS = ("select", "order", "limit", "offset", "on_conflict", "columns")
+_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+_UNESCAPE = re.compile(r"\\(.)")
+
+
+@lru_cache(maxsize=100_000)
+def _parse_datetime(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _coerce(row_value: Any, raw: str):
+    """Convert a filter literal to something comparable with `row_value`"""
+    if len(raw) > 1 and raw[0] == raw[-1] == '"':
+        raw = _UNESCAPE.sub(r"\1", raw[1:-1])
+    if raw == "null":
+        return None, row_value
+    if isinstance(row_value, bool):
+        return raw.lower() == "true", row_value
+    if isinstance(row_value, int):
+        return int(raw), row_value
+    if isinstance(row_value, float):
+        return float(raw), row_value
+    if (
+        isinstance(row_value, str)
+        and _DATETIME.match(row_value)
+        and _DATETIME.match(raw)
+    ):
+        return _parse_datetime(raw), _parse_datetime(row_value)
+    return raw, row_value
+
+
+def _split_top_level(expr: str) -> List[str]:
+    parts, depth, quoted, escaped, current = [], 0, False, False, ""
+    for char in expr:
+        if escaped:
+            escaped = False
+        elif quoted and char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _condition(expr: str) -> Callable[[dict], bool]:
+    """Compile `col.op.value`, `or(...)` or `and(...)` into a row predicate"""
+    for group, combine in (("or", any), ("and", all)):
+        if expr.startswith(f"{group}("):
+            checks = [
+                _condition(part) for part in _split_top_level(expr[len(group) + 1 : -1])
+            ]
+            return lambda row, checks=checks, combine=combine: combine(
+                c(row) for c in checks
+            )
+
+    column, op, raw = expr.split(".", 2)
+    return _filter(column, f"{op}.{raw}")
+
+
+def _filter(column: str, spec: str) -> Callable[[dict], bool]:
+    negate = spec.startswith("not.")
+    if negate:
+        spec = spec[4:]
+    op, raw = spec.split(".", 1)
+
+    if op == "in":
+        values = [v.strip('"') for v in raw.strip("()").split(",")]
+
+        def check(row):
+            return str(row.get(column)) in values
+
+    else:
+        compare = OPERATORS[op]
+
+        def check(row):
+            value, current = _coerce(row.get(column), raw)
+            return compare(current, value)
+
+    return (lambda row: not check(row)) if negate else check
+
+
+class FakePostgrest(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Thread-safe in-memory tables served over the PostgREST wire format"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables: Dict[str, List[dict]] = {name: [] for name in TABLES}
+        self.rpcs: Dict[str, Callable[["FakePostgrest", dict], Any]] = dict(RPCS)
+        self.requests = 0
+        self._ids: Dict[str, int] = {name: 0 for name in TABLES}
+        self._lock = threading.Lock()
+
+    def seed(self, table: str, rows: List[dict]):
+        with self._lock:
+            for row in rows:
+                self._insert(table, dict(row))
+
+    def rpc(self, name: str):
+        def register(fn):
+            self.rpcs[name] = fn
+            return fn
+
+        return register
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(request)
+
+    def _respond(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            name = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+            body = json.loads(request.content) if request.content else None
+
+            if "/rpc/" in request.url.path:
+                result = self.rpcs[name](self, body or {})
+                return httpx.Response(200, json=result)
+
+            params = request.url.params
+            rows = self.tables.setdefault(name, [])
+
+            if request.method in ("GET", "HEAD"):
+                result = self._select(rows, params)
+            elif request.method == "POST":
+                result = self._write(name, body, params, request.headers)
+            elif request.method == "PATCH":
+                result = self._where(rows, params)
+                for row in result:
+                    row.update(body)
+            elif request.method == "DELETE":
+                result = self._where(rows, params)
+                deleted = {id(row) for row in result}
+                self.tables[name] = [row for row in rows if id(row) not in deleted]
+            else:
+                return httpx.Response(405)
+
+        if "vnd.pgrst.object" in request.headers.get("Accept", ""):
+            if len(result) != 1:
+                return httpx.Response(
+                    406,
+                    json={
+                        "message": "JSON object requested, multiple (or no) rows returned",
+                        "code": "PGRST116",
+                        "hint": None,
+                        "details": f"The result contains {len(result)} rows",
+                    },
+                )
+            return httpx.Response(200, json=result[0])
+        return httpx.Response(200, json=result)
+
+    def _where(self, rows: List[dict], params: httpx.QueryParams) -> List[dict]:
+        checks = [
+            (
+                _condition(f"{column}{spec}")
+                if column in ("or", "and")
+                else _filter(column, spec)
+            )
+            for column, spec in params.multi_items()
+            if column not in RESERVED_PARAMS
+        ]
+        return [row for row in rows if all(check(row) for check in checks)]
+
+    def _select(self, rows: List[dict], params: httpx.QueryParams) -> List[dict]:
+        result = self._where(rows, params)
+
+        for term in reversed(
+            params.get("order", "").split(",") if params.get("order") else []
+        ):
+            column, _, direction = term.partition(".")
+            result.sort(
+                key=lambda row: (row.get(column) is None, row.get(column)),
+                reverse=direction.startswith("desc"),
+            )
+
+        offset = int(params.get("offset", 0))
+        limit = params.get("limit")
+        result = result[offset : offset + int(limit) if limit else None]
+
+        columns = params.get("select", "*")
+        if columns != "*":
+            names = [c.strip() for c in columns.split(",")]
+            result = [{c: row.get(c) for c in names} for row in result]
+        return [dict(row) for row in result]
+
+    def _write(self, table: str, body, params, headers) -> List[dict]:
+        rows = body if isinstance(body, list) else [body]
+        conflict = params.get("on_conflict")
+        if not conflict and "resolution=merge-duplicates" in headers.get("Prefer", ""):
+            conflict = "id"
+
+        written = []
+        for row in rows:
+            existing = None
+            if conflict:
+                existing = next(
+                    (
+                        r
+                        for r in self.tables[table]
+                        if r.get(conflict) == row.get(conflict)
+                    ),
+                    None,
+                )
+            if existing is not None:
+                if "resolution=ignore-duplicates" in headers.get("Prefer", ""):
+                    continue
+                existing.update(row)
+                written.append(dict(existing))
+            else:
+                written.append(dict(self._insert(table, dict(row))))
+        return written
+
+    def _insert(self, table: str, row: dict) -> dict:
+        if row.get("id") is None:
+            self._ids[table] += 1
+            row["id"] = self._ids[table]
+        else:
+            self._ids[table] = max(self._ids[table], row["id"])
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+
+# Stand-ins for the functions in sql/, they run under the transport lock
+
+
+def increment_rollups(fake: FakePostgrest, params: dict):
+    table = fake.tables.setdefault("rollups", [])
+    index = {
+        (r["domain_id"], r["dimension"], _parse_datetime(r["bucket"]), r["key"]): r
+        for r in table
+    }
+    for row in params["rows"]:
+        key = (
+            row["domain_id"],
+            row["dimension"],
+            _parse_datetime(row["bucket"]),
+            row["key"],
+        )
+        if key in index:
+            index[key]["count"] += row["count"]
+        else:
+            index[key] = dict(row)
+            table.append(index[key])
+
+
+def rollup_summary(fake: FakePostgrest, params: dict):
+    start = _parse_datetime(params["p_start"]).replace(
+        minute=0, second=0, microsecond=0
+    )
+    end = _parse_datetime(params["p_end"])
+    merged: Dict[tuple, int] = {}
+    for row in fake.tables.get("rollups", []):
+        if row["domain_id"] != params["p_domain_id"]:
+            continue
+        if not start <= _parse_datetime(row["bucket"]) <= end:
+            continue
+        key = (row["dimension"], row["key"])
+        merged[key] = merged.get(key, 0) + row["count"]
+
+    result, totals = [], {}
+    for (dimension, key), count in sorted(merged.items(), key=lambda i: -i[1]):
+        totals[dimension] = totals.get(dimension, 0) + count
+        if sum(r["dimension"] == dimension for r in result) < params.get("p_top", 10):
+            result.append({"dimension": dimension, "key": key, "count": count})
+    result += [
+        {"dimension": "total", "key": dimension, "count": count}
+        for dimension, count in totals.items()
+    ]
+    return result
+
+
+def rollup_timeseries(fake: FakePostgrest, params: dict):
+    from core.rollups import EVENT_DIMENSION, truncate
+
+    granularity = params["p_granularity"]
+    start = _parse_datetime(params["p_start"])
+    end = _parse_datetime(params["p_end"])
+    event_type = params.get("p_event_type")
+    counts: Dict[datetime, list] = {}
+
+    if granularity == "minute":
+        for row in fake.tables.get("events", []):
+            if row["domain_id"] != params["p_domain_id"]:
+                continue
+            if event_type is not None and row["event_type"] != event_type:
+                continue
+            timestamp = _parse_datetime(row["timestamp"])
+            if start <= timestamp <= end:
+                counts.setdefault(truncate(timestamp, "minute"), [0, 0])[0] += 1
+    else:
+        first_hour = truncate(start, "hour")
+        for row in fake.tables.get("rollups", []):
+            if row["domain_id"] != params["p_domain_id"]:
+                continue
+            if row["dimension"] != EVENT_DIMENSION:
+                continue
+            if event_type is not None and row["key"] != event_type:
+                continue
+            bucket = _parse_datetime(row["bucket"])
+            if first_hour <= bucket <= end:
+                bucket = truncate(bucket, granularity)
+                counts.setdefault(bucket, [0, 0])[0] += row["count"]
+
+    for row in fake.tables.get("sessions", []):
+        if row["domain_id"] != params["p_domain_id"]:
+            continue
+        session_start = _parse_datetime(row["start"])
+        if start <= session_start <= end:
+            bucket = truncate(session_start, granularity)
+            counts.setdefault(bucket, [0, 0])[1] += 1
+
+    return [
+        {"bucket": bucket.isoformat(), "events": events, "sessions": sessions}
+        for bucket, (events, sessions) in sorted(counts.items())
+    ]
+
+
+def increment_path_edges(fake: FakePostgrest, params: dict):
+    table = fake.tables.setdefault("path_edges", [])
+    index = {(r["domain_id"], r["day"], r["from_path"], r["to_path"]): r for r in table}
+    for row in params["rows"]:
+        key = (row["domain_id"], row["day"], row["from_path"], row["to_path"])
+        if key in index:
+            index[key]["count"] += row["count"]
+        else:
+            index[key] = dict(row)
+            table.append(index[key])
+
+
+def _path_edges(fake: FakePostgrest, params: dict) -> List[dict]:
+    return [
+        row
+        for row in fake.tables.get("path_edges", [])
+        if row["domain_id"] == params["p_domain_id"]
+        and params["p_start"] <= row["day"] <= params["p_end"]
+    ]
+
+
+def path_neighbors(fake: FakePostgrest, params: dict):
+    near, far = (
+        ("from_path", "to_path")
+        if params.get("p_forward", True)
+        else ("to_path", "from_path")
+    )
+    counts: Dict[str, int] = {}
+    for row in _path_edges(fake, params):
+        if row[near] == params["p_path"]:
+            counts[row[far]] = counts.get(row[far], 0) + row["count"]
+
+    total = sum(counts.values())
+    ranked = sorted(
+        ((path, count) for path, count in counts.items() if count > 0),
+        key=lambda i: (-i[1], i[0]),
+    )
+    return [
+        {"path": path, "count": count, "total": total}
+        for path, count in ranked[: params.get("p_top", 10)]
+    ]
+
+
+def path_funnel(fake: FakePostgrest, params: dict):
+    from core.paths import ENTRANCE
+
+    steps = params["p_steps"]
+    edges = _path_edges(fake, params)
+    result = []
+    for step, path in enumerate(steps, start=1):
+        if step > 1:
+            match = lambda r: (r["from_path"], r["to_path"]) == (steps[step - 2], path)
+        elif path == ENTRANCE:
+            match = lambda r: r["from_path"] == ENTRANCE
+        else:
+            match = lambda r: r["to_path"] == path
+        count = sum(row["count"] for row in edges if match(row))
+        result.append({"step": step, "path": path, "count": count})
+    return result
+
+
+def merge_sessions(fake: FakePostgrest, params: dict):
+    table = fake.tables.setdefault("sessions", [])
+    index = {r["session_id"]: r for r in table}
+    for row in params["rows"]:
+        stored = index.get(row["session_id"])
+        if stored is None:
+            index[row["session_id"]] = fake._insert("sessions", dict(row))
+            continue
+
+        start, end = _parse_datetime(row["start"]), _parse_datetime(row["end"])
+        if row["entry_path"] and (
+            not stored["entry_path"] or start < _parse_datetime(stored["start"])
+        ):
+            stored["entry_path"] = row["entry_path"]
+        if row["exit_path"] and (
+            not stored["exit_path"] or end >= _parse_datetime(stored["end"])
+        ):
+            stored["exit_path"] = row["exit_path"]
+        start = min(start, _parse_datetime(stored["start"]))
+        end = max(end, _parse_datetime(stored["end"]))
+        stored.update(
+            start=start.isoformat(),
+            end=end.isoformat(),
+            duration=(end - start).total_seconds(),
+            event_count=stored["event_count"] + row["event_count"],
+        )
+        for column in ("user_id", "device", "os", "browser"):
+            if stored.get(column) is None:
+                stored[column] = row[column]
+
+
+def merge_sketches(fake: FakePostgrest, params: dict):
+    from core.uniques import decode_sketch, encode_sketch
+
+    table = fake.tables.setdefault("sketches", [])
+    index = {
+        (r["domain_id"], r["dimension"], r["key"], _parse_datetime(r["bucket"])): r
+        for r in table
+    }
+    for row in params["rows"]:
+        key = (
+            row["domain_id"],
+            row["dimension"],
+            row["key"],
+            _parse_datetime(row["bucket"]),
+        )
+        if key in index:
+            sketch = decode_sketch(index[key]["sketch"])
+            sketch.update(decode_sketch(row["sketch"]))
+            index[key]["sketch"] = encode_sketch(sketch)
+        else:
+            index[key] = dict(row)
+            table.append(index[key])
+
+
+def union_sketches(fake: FakePostgrest, params: dict):
+    from core.hll import HyperLogLog
+    from core.uniques import decode_sketch, encode_sketch
+
+    start = _parse_datetime(params["p_start"]).replace(
+        minute=0, second=0, microsecond=0
+    )
+    end = _parse_datetime(params["p_end"])
+    merged = HyperLogLog.union(
+        decode_sketch(row["sketch"])
+        for row in fake.tables.get("sketches", [])
+        if row["domain_id"] == params["p_domain_id"]
+        and row["dimension"] == params["p_dimension"]
+        and row["key"] == params["p_key"]
+        and start <= _parse_datetime(row["bucket"]) <= end
+    )
+    return encode_sketch(merged) if merged else None
+
+
+def rotate_refresh_token(fake: FakePostgrest, params: dict):
+    now = datetime.now(timezone.utc)
+    for row in fake.tables["tokens"]:
+        if (
+            row["token_hash"] == params["p_old_hash"]
+            and not row["revoked"]
+            and _parse_datetime(row["expires_at"]) > now
+        ):
+            row["revoked"] = True
+            fake._insert(
+                "tokens",
+                {
+                    "user_id": row["user_id"],
+                    "token_hash": params["p_new_hash"],
+                    "expires_at": params["p_expires_at"],
+                    "revoked": False,
+                },
+            )
+            user = next(u for u in fake.tables["users"] if u["id"] == row["user_id"])
+            return [{"user_id": user["id"], "email": user["email"]}]
+    return []
+
+
+RPCS = {
+    "increment_path_edges": increment_path_edges,
+    "increment_rollups": increment_rollups,
+    "merge_sessions": merge_sessions,
+    "merge_sketches": merge_sketches,
+    "path_funnel": path_funnel,
+    "path_neighbors": path_neighbors,
+    "rollup_summary": rollup_summary,
+    "rollup_timeseries": rollup_timeseries,
+    "rotate_refresh_token": rotate_refresh_token,
+    "union_sketches": union_sketches,
+}
+
+
+def install(fake: FakePostgrest):
+    """Point `database.db()` and `database.adb()` at `fake`"""
+    from postgrest import AsyncPostgrestClient, SyncPostgrestClient
+
+    import database
+
+    base_url = "http://fake-postgrest/rest/v1"
+    database.supabase = SyncPostgrestClient(
+        base_url, http_client=httpx.Client(transport=fake)
+    )
+    database._async_client = AsyncPostgrestClient(
+        base_url, http_client=httpx.AsyncClient(transport=fake)
+    )
+    return fake
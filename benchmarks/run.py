@@ -0,0 +1,336 @@
+"""Offline benchmarks and load scenarios.
+
+Runs against `FakePostgrest`, so no Supabase credentials are needed:
+
+    python -m benchmarks.run --latency 0.005 --out bench.json
+
+Every result is a flat JSON record so runs from two releases can be
+diffed or loaded into a dataframe.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+import httpx
+
+from benchmarks.fake_postgrest import FakePostgrest, install
+
+DOMAIN = "bench.example.com"
+API_KEY = f"cKey_{DOMAIN}_" + "k" * 43
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark-password"
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+]
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_events(sessions: int, per_session: int) -> List[dict]:
+    events = []
+    for s in range(sessions):
+        session_id = str(uuid.UUID(int=s))
+        for i in range(per_session):
+            event_type = (
+                "page_load" if i == 0 else "exit" if i == per_session - 1 else "click"
+            )
+            events.append(
+                {
+                    "domain": DOMAIN,
+                    "pathname": f"/page/{(s + i) % 20}",
+                    "referrer": None,
+                    "user_agent": USER_AGENTS[s % len(USER_AGENTS)],
+                    "screen_width": 1280,
+                    "screen_height": 720,
+                    "session_id": session_id,
+                    "event_type": event_type,
+                    "element": "a",
+                    "time_spent": float(i),
+                    "timestamp": (START + timedelta(seconds=s * 60 + i)).isoformat(),
+                    "domain_id": 1,
+                    "user_id": 1,
+                }
+            )
+    return events
+
+
+def seed(fake: FakePostgrest, events: List[dict] = ()):
+    from utils import hash_api_key, hash_password
+
+    fake.seed(
+        "domains",
+        [{"id": 1, "domain": DOMAIN, "is_active": True, "owner_id": 1}],
+    )
+    fake.seed(
+        "api_keys",
+        [
+            {
+                "domain": DOMAIN,
+                "domain_id": 1,
+                "key_hash": hash_api_key(API_KEY),
+                "revoked": False,
+            }
+        ],
+    )
+    fake.seed("users", [{"id": 1, "email": EMAIL, "password": hash_password(PASSWORD)}])
+    fake.seed("events", events)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `samples`"""
+    return samples[max(0, math.ceil(q * len(samples)) - 1)]
+
+
+def summarize(name: str, kind: str, samples: List[float], **extra) -> dict:
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "name": name,
+        "kind": kind,
+        "iterations": len(samples),
+        "mean_ms": total / len(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": samples[-1] * 1000,
+        **extra,
+    }
+
+
+def timeit(fn: Callable, iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def micro(iterations: int) -> List[dict]:
+    from pydantic import TypeAdapter
+
+    from core.agents import AgentParser
+    from core.serialization import dump_rows
+    from models import EventData
+    from utils import build_session, create_access_token, hash_api_key
+
+    session_events = make_events(1, 50)
+    cold_parser = AgentParser(maxsize=0)
+    warm_parser = AgentParser()
+
+    page = make_events(100, 20)
+    for id, event in enumerate(page, 1):
+        event.update({"id": id, "created_at": event["timestamp"]})
+    events_adapter = TypeAdapter(List[EventData])
+
+    return [
+        summarize(
+            "build_session",
+            "micro",
+            timeit(lambda: build_session(session_events), iterations),
+            events=len(session_events),
+        ),
+        summarize(
+            "parse_agent_uncached",
+            "micro",
+            timeit(lambda: cold_parser.parse(USER_AGENTS[2]), iterations),
+        ),
+        summarize(
+            "parse_agent_cached",
+            "micro",
+            timeit(lambda: warm_parser.parse(USER_AGENTS[2]), iterations),
+        ),
+        summarize(
+            "hash_api_key",
+            "micro",
+            timeit(lambda: hash_api_key(API_KEY), iterations),
+        ),
+        summarize(
+            "create_access_token",
+            "micro",
+            timeit(lambda: create_access_token(1), iterations),
+        ),
+        summarize(
+            "serialize_events_validated",
+            "micro",
+            timeit(
+                lambda: events_adapter.dump_json(events_adapter.validate_python(page)),
+                max(iterations // 10, 1),
+            ),
+            rows=len(page),
+        ),
+        summarize(
+            "serialize_events_trusted",
+            "micro",
+            timeit(lambda: dump_rows(page, EventData), max(iterations // 10, 1)),
+            rows=len(page),
+        ),
+    ]
+
+
+async def load(
+    client: httpx.AsyncClient,
+    name: str,
+    request: Callable,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    samples: List[float] = []
+    statuses: dict = {}
+    pending = iter(range(requests))
+
+    async def worker():
+        for _ in pending:
+            started = time.perf_counter()
+            response = await request(client)
+            samples.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return summarize(
+        name,
+        "macro",
+        samples,
+        concurrency=concurrency,
+        throughput_rps=len(samples) / elapsed,
+        statuses={str(k): v for k, v in statuses.items()},
+    )
+
+
+async def macro(fake: FakePostgrest, requests: int, concurrency: int) -> List[dict]:
+    from core.responses import domain_scope, response_cache
+    from main import app
+    from utils import create_access_token
+
+    batch = make_events(1, 20)
+    for event in batch:
+        event.pop("domain_id")
+        event.pop("user_id")
+
+    end = START + timedelta(days=1)
+    dashboard_headers = {"Authorization": f"Bearer {create_access_token(1, EMAIL)}"}
+    sessions_query = {
+        "domain": DOMAIN,
+        "start": START.isoformat(),
+        "end": end.isoformat(),
+    }
+
+    async def track(client):
+        return await client.post(
+            "/events/track",
+            json=batch,
+            headers={"Authorization": f"Bearer {API_KEY}"},
+        )
+
+    async def sessions(client):
+        # Drop stored and cached sessions so every request exercises the rebuild
+        fake.tables["sessions"].clear()
+        response_cache.bump(domain_scope(1))
+        return await client.get(
+            "/analytics/sessions", params=sessions_query, headers=dashboard_headers
+        )
+
+    async def login(client):
+        return await client.post(
+            "/auth/login", data={"username": EMAIL, "password": PASSWORD}
+        )
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        return [
+            await load(client, "POST /events/track", track, requests, concurrency),
+            await load(
+                client,
+                "GET /analytics/sessions",
+                sessions,
+                max(requests // 10, 1),
+                concurrency,
+            ),
+            await load(
+                client,
+                "POST /auth/login",
+                login,
+                max(requests // 10, 1),
+                concurrency,
+            ),
+            # Tracking latency while a login burst is hashing passwords
+            *(
+                await asyncio.gather(
+                    load(
+                        client,
+                        "POST /events/track during logins",
+                        track,
+                        requests,
+                        concurrency,
+                    ),
+                    load(
+                        client,
+                        "POST /auth/login burst",
+                        login,
+                        max(requests // 10, 1),
+                        concurrency,
+                    ),
+                )
+            ),
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per fake DB call"
+    )
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--sessions", type=int, default=500, help="sessions seeded for analytics"
+    )
+    parser.add_argument("--only", choices=("micro", "macro"))
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    fake = install(FakePostgrest(latency=args.latency))
+    seed(fake, make_events(args.sessions, 10))
+
+    results = []
+    if args.only != "macro":
+        results += micro(args.iterations)
+    if args.only != "micro":
+        results += asyncio.run(macro(fake, args.requests, args.concurrency))
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "db_requests": fake.requests,
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,20 @@ class settings(BaseSettings):
     # Database
     DB_URL: str
     DB_KEY: str
+    DB_POOL_SIZE: int = 20
+    DB_POOL_KEEPALIVE: int = 10
+    DB_TIMEOUT: float = 10.0
+    DB_SLOW_QUERY_SECONDS: float = 0.5
     # JWT
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     REFRESH_TOKEN_EXPIRE_DAYS: int
+    # Password hashing pool
+    HASH_WORKERS: int = 2
+    HASH_MAX_PENDING: int = 32
+    # Concurrent /events/bulk uploads
+    BULK_MAX_UPLOADS: int = 2
 
     model_config = (
         SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
@@ -0,0 +1,94 @@
+import re
+from typing import Iterable
+
+from core.cache import TTLCache
+
+# Plain desktop Chrome/Edge/Firefox builds make up most of the traffic and
+# carry no extra vendor tokens, so they can be classified without running
+# the full user_agents regex list. Anything else falls through to it.
+_PLATFORM = r"(?P<platform>Windows NT [\d.]+|Macintosh; Intel Mac OS X [\d_.]+|X11; Linux x86_64)"
+_FAST_PATHS = (
+    (
+        re.compile(
+            rf"^Mozilla/5\.0 \({_PLATFORM}[^)]*\) AppleWebKit/537\.36 "
+            r"\(KHTML, like Gecko\) Chrome/[\d.]+ Safari/537\.36$"
+        ),
+        "Chrome",
+    ),
+    (
+        re.compile(
+            rf"^Mozilla/5\.0 \({_PLATFORM}[^)]*\) AppleWebKit/537\.36 "
+            r"\(KHTML, like Gecko\) Chrome/[\d.]+ Safari/537\.36 Edg/[\d.]+$"
+        ),
+        "Edge",
+    ),
+    (
+        re.compile(
+            rf"^Mozilla/5\.0 \({_PLATFORM}[^)]*; rv:[\d.]+\) Gecko/20100101 Firefox/[\d.]+$"
+        ),
+        "Firefox",
+    ),
+)
+_PLATFORM_OS = (
+    ("Windows", "Windows"),
+    ("Macintosh", "Mac OS X"),
+    ("X11", "Linux"),
+)
+
+
+class AgentParser:
+    """Memoized user-agent classification into device, os and browser"""
+
+    def __init__(self, maxsize: int = 10_000):
+        self._cache = TTLCache(maxsize=maxsize, ttl=float("inf"), name="user_agents")
+        self.fast_path = 0
+        self.full_parses = 0
+
+    def parse(self, user_agent: str) -> dict:
+        agent = self._cache.get(user_agent)
+        if agent is None:
+            agent = self._fast_parse(user_agent) or self._full_parse(user_agent)
+            self._cache.set(user_agent, agent)
+        return agent
+
+    def warm(self, user_agents: Iterable[str]) -> int:
+        """Pre-populate the memo, e.g. with yesterday's distinct agents"""
+        count = 0
+        for user_agent in user_agents:
+            self.parse(user_agent)
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "fast_path": self.fast_path,
+            "full_parses": self.full_parses,
+        }
+
+    def _fast_parse(self, user_agent: str) -> dict | None:
+        for pattern, browser in _FAST_PATHS:
+            match = pattern.match(user_agent)
+            if match:
+                platform = match.group("platform")
+                os = next(
+                    name for prefix, name in _PLATFORM_OS if platform.startswith(prefix)
+                )
+                self.fast_path += 1
+                return {"device": "desktop", "os": os, "browser": browser}
+        return None
+
+    def _full_parse(self, user_agent: str) -> dict:
+        # user_agents compiles its whole regex list on import (~0.2s), so it
+        # is only loaded once an agent misses every fast path
+        from user_agents import parse
+
+        ua = parse(user_agent)
+        self.full_parses += 1
+
+        device = "mobile" if ua.is_mobile else "tablet" if ua.is_tablet else "desktop"
+
+        return {"device": device, "os": ua.os.family, "browser": ua.browser.family}
+
+
+agent_parser = AgentParser()
@@ -0,0 +1,211 @@
+import gzip
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import RedirectResponse
+
+from core.responses import etag_matches
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is in requirements
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# The stable URL is revalidated hourly, a 304 when nothing was released
+REVALIDATE = "public, max-age=3600, stale-while-revalidate=86400"
+
+# Separators after/before which a newline can't end a statement
+_JOINS_AFTER = set("{([,;:=")
+_JOINS_BEFORE = set(")]},;")
+
+
+def _word(c: str) -> bool:
+    return c.isalnum() or c in "_$"
+
+
+def _skip_string(source: str, i: int) -> int:
+    quote, j, n = source[i], i + 1, len(source)
+    while j < n:
+        if source[j] == "\\":
+            j += 2
+            continue
+        if source[j] == quote:
+            return j + 1
+        j += 1
+    return n
+
+
+def _skip_regex(source: str, i: int) -> int:
+    j, n, in_class = i + 1, len(source), False
+    while j < n:
+        c = source[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == "\n":
+            return j
+        if c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            j += 1
+            while j < n and source[j].isalpha():
+                j += 1
+            return j
+        j += 1
+    return n
+
+
+def minify_js(source: str) -> str:
+    """Strip comments and indentation from a script.
+
+    Deliberately conservative: line breaks that could end a statement are
+    kept, so automatic semicolon insertion behaves as in the source, and
+    string, template and regex literals are copied untouched. Template
+    literals nesting other template literals aren't supported.
+    """
+    out = []
+    last = ""
+    space = newline = False
+    i, n = 0, len(source)
+
+    while i < n:
+        c = source[i]
+
+        if c.isspace():
+            newline = newline or c == "\n"
+            space = True
+            i += 1
+            continue
+        if source.startswith("//", i):
+            end = source.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            space = True
+            continue
+
+        if out and space:
+            if newline and last not in _JOINS_AFTER and c not in _JOINS_BEFORE:
+                out.append("\n")
+            elif (_word(last) and _word(c)) or (last in "+-/" and c in "+-/"):
+                out.append(" ")
+        space = newline = False
+
+        if c in "'\"`":
+            end = _skip_string(source, i)
+        elif c == "/" and (not last or last in "(,=:[!&|?{};"):
+            end = _skip_regex(source, i)
+        else:
+            end = i + 1
+
+        out.append(source[i:end])
+        last = source[end - 1]
+        i = end
+
+    return "".join(out) + "\n"
+
+
+def accepted_encodings(accept_encoding: str | None) -> set:
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAsset:
+    """A script minified and precompressed once, served from memory.
+
+    Each variant (br, gzip, identity) has its own strong ETag derived from
+    the content hash. `url` is the versioned, immutable address of the
+    current build; the stable path is only cached for an hour and
+    revalidates to a 304 until the file changes.
+    """
+
+    media_type = "application/javascript; charset=utf-8"
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.version: str | None = None
+        self._variants: Dict[str, Tuple[bytes, str]] = {}
+
+    @property
+    def url(self) -> str:
+        self._ensure_loaded()
+        return f"/{self.path.stem}.{self.version}{self.path.suffix}"
+
+    def load(self):
+        body = minify_js(self.path.read_text(encoding="utf-8")).encode()
+        version = sha256(body).hexdigest()[:12]
+
+        variants = {"identity": (body, f'"{version}"')}
+        variants["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{version}-gzip"')
+        if brotli is not None:
+            variants["br"] = (
+                brotli.compress(body, mode=brotli.MODE_TEXT, quality=11),
+                f'"{version}-br"',
+            )
+
+        self._variants = variants
+        self.version = version
+
+    def _ensure_loaded(self):
+        if self.version is None:
+            self.load()
+
+    def stats(self) -> dict:
+        self._ensure_loaded()
+        return {
+            "version": self.version,
+            "url": self.url,
+            "bytes": {
+                coding: len(body) for coding, (body, _) in self._variants.items()
+            },
+        }
+
+    def respond(self, request: Request, version: str | None = None) -> Response:
+        """Serve the best variant for Accept-Encoding.
+
+        With `version` the request is for the immutable URL; an old
+        version redirects to the current one.
+        """
+        self._ensure_loaded()
+
+        if version is not None and version != self.version:
+            return RedirectResponse(self.url, status_code=302)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        coding = next(
+            (c for c in ("br", "gzip") if c in accepted and c in self._variants),
+            "identity",
+        )
+        body, etag = self._variants[coding]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE if version else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+tracker = StaticAsset(Path(__file__).resolve().parent.parent / "static" / "tracker.js")
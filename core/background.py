@@ -0,0 +1,49 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """Base for ingestion-time aggregators flushed by a daemon thread.
+
+    Subclasses implement `flush(final=False)`. The thread is started on
+    first use and `stop()` runs one last `flush(final=True)`.
+    """
+
+    name = "flusher"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def flush(self, final: bool = False):
+        raise NotImplementedError
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.interval)
+            self._thread = None
+        self.flush(final=True)
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("%s flush failed", self.name)
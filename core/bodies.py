@@ -0,0 +1,217 @@
+import zlib
+from typing import AsyncIterator, Iterator, List, Tuple
+
+import orjson
+from fastapi import HTTPException, Request, status
+from pydantic import TypeAdapter, ValidationError
+
+from models import Event
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is in requirements
+    brotli = None
+
+MAX_BODY_BYTES = 256 * 1024  # decompressed /events/track body
+MAX_LINE_BYTES = 64 * 1024  # one NDJSON line of /events/bulk
+DECODE_STEP = 64 * 1024  # largest piece a decoder emits at once
+GZIP_MAGIC = b"\x1f\x8b"
+events_adapter = TypeAdapter(List[Event])
+
+
+def too_large(limit: int = MAX_BODY_BYTES):
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"body exceeds {limit} bytes",
+    )
+
+
+class _Identity:
+    def decode(self, chunk: bytes, step: int) -> Iterator[bytes]:
+        yield chunk
+
+
+class _Gzip:
+    def __init__(self):
+        self._d = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)  # gzip or zlib
+
+    def decode(self, chunk: bytes, step: int) -> Iterator[bytes]:
+        yield self._d.decompress(chunk, step)
+        while self._d.unconsumed_tail:
+            yield self._d.decompress(self._d.unconsumed_tail, step)
+
+
+class _Brotli:
+    def __init__(self):
+        self._d = brotli.Decompressor()
+
+    def decode(self, chunk: bytes, step: int) -> Iterator[bytes]:
+        piece = self._d.process(chunk, output_buffer_limit=step)
+        # can_accept_more_data() turns true before the buffered output is
+        # drained, so keep going until nothing comes out
+        while piece:
+            yield piece
+            if self._d.is_finished():
+                return
+            piece = self._d.process(b"", output_buffer_limit=step)
+
+
+def _decoder(encoding: str):
+    if encoding in ("", "identity"):
+        return _Identity()
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        return _Gzip()
+    if encoding == "br" and brotli is not None:
+        return _Brotli()
+    raise HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail=f"unsupported Content-Encoding {encoding!r}",
+    )
+
+
+async def _peek(
+    chunks: AsyncIterator[bytes], size: int
+) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """The first `size` bytes of `chunks`, and all of them again"""
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            break
+
+    async def replay():
+        if head:
+            yield head
+        async for chunk in chunks:
+            yield chunk
+
+    return head[:size], replay()
+
+
+async def stream_body(
+    request: Request, sniff_gzip: bool = False
+) -> AsyncIterator[bytes]:
+    """Yield the request body decompressed, at most DECODE_STEP bytes at a
+    time, so even a highly compressed chunk never expands all at once.
+
+    With `sniff_gzip`, a body sent without Content-Encoding is gunzipped if
+    it starts with the gzip magic bytes: sendBeacon can't set the header.
+    """
+    encoding = request.headers.get("content-encoding", "").strip().lower()
+    chunks = request.stream()
+    if sniff_gzip and encoding in ("", "identity"):
+        head, chunks = await _peek(chunks, len(GZIP_MAGIC))
+        if head == GZIP_MAGIC:
+            encoding = "gzip"
+    decoder = _decoder(encoding)
+
+    try:
+        async for chunk in chunks:
+            for piece in decoder.decode(chunk, DECODE_STEP):
+                if piece:
+                    yield piece
+    except (zlib.error, getattr(brotli, "error", zlib.error)):
+        raise HTTPException(status_code=400, detail="malformed compressed body")
+
+
+async def read_body(
+    request: Request, limit: int = MAX_BODY_BYTES, sniff_gzip: bool = False
+) -> bytes:
+    """Read the request body, decompressing it as it streams in.
+
+    Stops with 413 as soon as the decoded size passes `limit`, so a small
+    compressed body can't expand into an unbounded buffer.
+    """
+    body = bytearray()
+    async for piece in stream_body(request, sniff_gzip):
+        body += piece
+        if len(body) > limit:
+            raise too_large(limit)
+
+    return bytes(body)
+
+
+async def iter_lines(
+    request: Request, max_line: int = MAX_LINE_BYTES
+) -> AsyncIterator[bytes | None]:
+    """Yield the lines of a newline-delimited body as they arrive.
+
+    A line longer than `max_line` is skipped up to its newline and yielded
+    as None, so the caller can report it without buffering it.
+    """
+    buffer = bytearray()
+    skipping = False
+
+    async for piece in stream_body(request):
+        start = 0
+        while (end := piece.find(b"\n", start)) != -1:
+            if skipping:
+                skipping = False
+                yield None
+            elif len(buffer) + end - start > max_line:
+                buffer.clear()
+                yield None
+            else:
+                buffer += piece[start:end]
+                yield bytes(buffer)
+                buffer.clear()
+            start = end + 1
+
+        if not skipping:
+            buffer += piece[start:]
+            if len(buffer) > max_line:
+                buffer.clear()
+                skipping = True
+
+    if skipping:
+        yield None
+    elif buffer:
+        yield bytes(buffer)
+
+
+def _load(body: bytes):
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="body is not valid JSON")
+
+
+def _validate(payload) -> List[Event]:
+    if isinstance(payload, dict):
+        shared = payload.get("shared") or {}
+        events = payload.get("events") or []
+        if not isinstance(shared, dict) or not isinstance(events, list):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="envelope needs an object `shared` and a list `events`",
+            )
+        payload = [
+            {**shared, **event} if isinstance(event, dict) else event
+            for event in events
+        ]
+
+    try:
+        return events_adapter.validate_python(payload)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=e.errors(include_url=False, include_context=False),
+        )
+
+
+def parse_events(body: bytes) -> List[Event]:
+    """Validate a tracker batch.
+
+    Accepts a plain list of events or the compact envelope
+    `{"shared": {...}, "events": [{...}, ...]}`, where fields common to
+    the whole batch are sent once and each event only carries its own.
+    """
+    return _validate(_load(body))
+
+
+def parse_beacon(body: bytes) -> Tuple[str | None, List[Event]]:
+    """Validate a `sendBeacon` batch, which can't carry an Authorization
+    header: the API key travels as `"key"` in the envelope instead."""
+    payload = _load(body)
+    key = payload.pop("key", None) if isinstance(payload, dict) else None
+    return key, _validate(payload)
@@ -0,0 +1,199 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import unquote
+
+from postgrest._async import request_builder as async_builders
+from postgrest._sync import request_builder as sync_builders
+
+from config import config
+from core.metrics import DB_STAGE, PREFIX, add_timing, labels
+
+slow_logger = logging.getLogger("cloudboard.slow_queries")
+
+MAX_FILTER_CHARS = 200  # of the query string kept per call
+
+# Builders whose `execute()` sends the request, every other builder
+# (select, filter, rpc) inherits it from one of these
+_BUILDERS = (
+    async_builders.AsyncQueryRequestBuilder,
+    async_builders.AsyncSingleRequestBuilder,
+    async_builders.AsyncMaybeSingleRequestBuilder,
+    sync_builders.SyncQueryRequestBuilder,
+    sync_builders.SyncSingleRequestBuilder,
+    sync_builders.SyncMaybeSingleRequestBuilder,
+)
+
+# Lists of calls being collected, innermost last
+_collectors: ContextVar[Tuple[List["DbCall"], ...]] = ContextVar(
+    "db_collectors", default=()
+)
+
+
+class DbCall:
+    """One PostgREST round trip"""
+
+    __slots__ = ("table", "operation", "filters", "rows", "seconds", "failed")
+
+    def __init__(self, request, response, seconds: float, failed: bool):
+        path = str(request.path).rstrip("/")
+        table = path.rsplit("/", 1)[-1]
+        method = request.http_method
+        prefer = request.headers.get("prefer", "")
+
+        if path.endswith(f"/rpc/{table}"):
+            self.operation = "rpc"
+        elif method == "POST":
+            self.operation = "upsert" if "resolution=" in prefer else "insert"
+        else:
+            self.operation = {
+                "GET": "select",
+                "HEAD": "count",
+                "PATCH": "update",
+                "DELETE": "delete",
+            }.get(method, method.lower())
+
+        self.table = table
+        self.filters = unquote(str(request.params))[:MAX_FILTER_CHARS]
+        self.seconds = seconds
+        self.failed = failed
+
+        data = getattr(response, "data", None)
+        self.rows = len(data) if isinstance(data, list) else int(data is not None)
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.operation} {self.table}?{self.filters} "
+            f"rows={self.rows} {self.seconds * 1000:.1f}ms"
+            f"{' failed' if self.failed else ''}>"
+        )
+
+
+class QueryTracer:
+    """Records every PostgREST call made through `db()` or `adb()`.
+
+    Each call adds to the request's `db` Server-Timing entry and per-route
+    call count (see core.metrics), to per table × operation totals, and is
+    logged as a slow query above `slow_seconds`.
+    """
+
+    def __init__(self, slow_seconds: float):
+        self.slow_seconds = slow_seconds
+        self.totals: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """Wrap the builders' `execute()`, once per process"""
+        if self._installed:
+            return
+        for builder in _BUILDERS:
+            execute = builder.execute
+            if builder.__module__ == async_builders.__name__:
+                builder.execute = self._wrap_async(execute)
+            else:
+                builder.execute = self._wrap_sync(execute)
+        self._installed = True
+
+    def _wrap_async(self, execute):
+        @functools.wraps(execute)
+        async def traced(builder):
+            started = time.perf_counter()
+            response, failed = None, True
+            try:
+                response = await execute(builder)
+                failed = False
+                return response
+            finally:
+                elapsed = time.perf_counter() - started
+                self.record(DbCall(builder.request, response, elapsed, failed))
+
+        return traced
+
+    def _wrap_sync(self, execute):
+        @functools.wraps(execute)
+        def traced(builder):
+            started = time.perf_counter()
+            response, failed = None, True
+            try:
+                response = execute(builder)
+                failed = False
+                return response
+            finally:
+                elapsed = time.perf_counter() - started
+                self.record(DbCall(builder.request, response, elapsed, failed))
+
+        return traced
+
+    def record(self, call: DbCall):
+        add_timing(DB_STAGE, call.seconds)
+
+        with self._lock:
+            total = self.totals.setdefault((call.table, call.operation), [0, 0.0, 0])
+            total[0] += 1
+            total[1] += call.seconds
+            total[2] += call.failed
+
+        for calls in _collectors.get():
+            calls.append(call)
+
+        if call.seconds >= self.slow_seconds:
+            slow_logger.warning("slow query %r", call)
+
+    @contextmanager
+    def collect(self) -> Iterator[List[DbCall]]:
+        """Collect the calls made inside the block, nested blocks included"""
+        calls: List[DbCall] = []
+        token = _collectors.set((*_collectors.get(), calls))
+        try:
+            yield calls
+        finally:
+            _collectors.reset(token)
+
+    def lines(self) -> Iterable[str]:
+        """Per table × operation totals as Prometheus series"""
+        with self._lock:
+            totals = list(self.totals.items())
+
+        for index, (field, description) in enumerate(
+            (
+                ("calls", "PostgREST calls"),
+                ("seconds", "Time spent in PostgREST calls"),
+                ("errors", "Failed PostgREST calls"),
+            )
+        ):
+            name = f"{PREFIX}_db_{field}_total"
+            yield f"# HELP {name} {description}"
+            yield f"# TYPE {name} counter"
+            for (table, operation), total in totals:
+                yield f"{name}{{{labels(table=table, operation=operation)}}} {total[index]}"
+
+
+tracer = QueryTracer(slow_seconds=config.DB_SLOW_QUERY_SECONDS)
+
+
+class TooManyQueries(AssertionError):
+    """Raised by `max_queries` when a block goes over its budget"""
+
+
+@contextmanager
+def max_queries(limit: int, label: str = "block") -> Iterator[List[DbCall]]:
+    """Fail if the block makes more than `limit` PostgREST calls.
+
+    For tests and benchmarks, e.g.
+
+        with max_queries(1, "POST /auth/refresh"):
+            client.post("/auth/refresh", ...)
+    """
+    with tracer.collect() as calls:
+        yield calls
+
+    if len(calls) > limit:
+        listing = "\n".join(f"  {call!r}" for call in calls)
+        raise TooManyQueries(
+            f"{label} made {len(calls)} database calls, budget is {limit}:\n{listing}"
+        )
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from pwdlib import PasswordHash
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram bucket bounds, seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_password_hash: PasswordHash | None = None
+
+
+def get_password_hash() -> PasswordHash:
+    """Argon2 hasher, built on first use so cold starts don't load argon2"""
+    global _password_hash
+    if _password_hash is None:
+        _password_hash = PasswordHash.recommended()
+    return _password_hash
+
+
+def _hash(password: str) -> str:
+    return get_password_hash().hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return get_password_hash().verify(plain_password, hashed_password)
+
+
+def _mp_context():
+    # The parent already runs the event writer and flusher threads, a forked
+    # child could inherit one of their locks held and deadlock on it
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class HashingBusy(Exception):
+    """Raised when the admission queue is full"""
+
+
+class PasswordHasher:
+    """Runs Argon2 hashing off the event loop in a size-limited process pool.
+
+    At most `max_pending` calls may be queued or running, further calls
+    fail fast with `HashingBusy` so a login burst can't stall the worker.
+    Falls back to threads where processes can't be spawned (serverless).
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Executor | None = None
+        self.pending = 0
+        self.rejected = 0
+        self.count = 0
+        self.total_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=_mp_context()
+                )
+            except (OSError, NotImplementedError):
+                logger.warning("process pool unavailable, hashing in threads")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="hashing"
+                )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingBusy()
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            self._observe(time.perf_counter() - started)
+
+    def _observe(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "count": self.count,
+            "mean_seconds": self.total_seconds / self.count if self.count else 0.0,
+            "buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], self.buckets)),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=config.HASH_WORKERS, max_pending=config.HASH_MAX_PENDING
+)
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import AsyncIterator, Callable, List, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+
+from config import config
+from core.metrics import timed
+from database import db
+from models import Event
+
+logger = logging.getLogger(__name__)
+
+# Queue sizing for the /events/track writer
+MAX_QUEUED_ROWS = 20_000
+FLUSH_ROWS = 1_000
+FLUSH_INTERVAL = 1.0  # seconds
+RETRY_BACKOFF = 2.0  # seconds
+MAX_RETRIES = 3
+
+# /events/bulk imports
+BULK_CHUNK_ROWS = 1_000
+MAX_BULK_ERRORS = 100  # line errors reported back, the rest are only counted
+
+
+class IngestQueueFull(Exception):
+    """Raised when the writer can't accept more rows"""
+
+
+class BulkWriteFailed(Exception):
+    """Raised when a bulk import chunk could not be inserted"""
+
+    def __init__(self, report: dict, line: int):
+        super().__init__(f"insert failed at line {line}")
+        self.report = report
+        self.line = line
+
+
+class EventWriter:
+    """Bounded in-process queue that coalesces tracked events into big inserts.
+
+    Requests enqueue rows and return right away, a daemon thread flushes
+    them when `flush_rows` are pending or the oldest row is older than
+    `flush_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        table: str = "events",
+        max_rows: int = MAX_QUEUED_ROWS,
+        flush_rows: int = FLUSH_ROWS,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        self.table = table
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self._rows: List[dict] = []
+        self._oldest: float | None = None
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._listeners: List[Tuple[Callable[[List[dict]], None], bool]] = []
+
+        self.flushed = 0
+        self.dropped = 0
+
+    def add_listener(
+        self, listener: Callable[[List[dict]], None], live_only: bool = False
+    ):
+        """Run `listener` on every batch after it has been written.
+
+        `live_only` listeners skip the batches of `write()` (bulk imports
+        of past events), for state kept by arrival time like open sessions.
+        """
+        self._listeners.append((listener, live_only))
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+    def enqueue(self, rows: List[dict]) -> int:
+        with self._cond:
+            if len(self._rows) + len(rows) > self.max_rows:
+                raise IngestQueueFull()
+
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+
+            if len(self._rows) >= self.flush_rows:
+                self._cond.notify()
+
+        self._ensure_started()
+        return len(rows)
+
+    def flush(self):
+        """Write everything that is pending from the calling thread"""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self._write(batch)
+
+    def write(self, batch: List[dict]) -> bool:
+        """Insert `batch` from the calling thread, bypassing the queue.
+
+        Retries like the background flush and runs the listeners that
+        aren't `live_only`, returns False if the rows were dropped.
+        """
+        return self._write(batch, live=False)
+
+    def stop(self, timeout: float = 10.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="event-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _take(self) -> List[dict]:
+        with self._cond:
+            batch = self._rows[: self.flush_rows]
+            del self._rows[: self.flush_rows]
+            self._oldest = time.monotonic() if self._rows else None
+            return batch
+
+    def _ready(self) -> bool:
+        if len(self._rows) >= self.flush_rows:
+            return True
+        return bool(self._rows) and (
+            time.monotonic() - self._oldest >= self.flush_interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._ready():
+                    timeout = None
+                    if self._rows:
+                        timeout = self.flush_interval - (
+                            time.monotonic() - self._oldest
+                        )
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+
+            self._write(self._take())
+
+    def _write(self, batch: List[dict], live: bool = True) -> bool:
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                with timed("event_insert"):
+                    db().table(self.table).insert(batch).execute()
+                break
+            except Exception:
+                logger.exception(
+                    "insert of %d rows into %s failed (attempt %d)",
+                    len(batch),
+                    self.table,
+                    attempt,
+                )
+                if attempt == MAX_RETRIES:
+                    self.dropped += len(batch)
+                    return False
+                time.sleep(RETRY_BACKOFF * attempt)
+
+        self.flushed += len(batch)
+
+        for listener, live_only in self._listeners:
+            if live_only and not live:
+                continue
+            try:
+                listener(batch)
+            except Exception:
+                logger.exception("ingest listener %r failed", listener)
+
+        return True
+
+
+event_writer = EventWriter()
+bulk_slots = asyncio.Semaphore(config.BULK_MAX_UPLOADS)
+
+
+def line_error(e: ValidationError) -> str:
+    error = e.errors(include_url=False)[0]
+    loc = ".".join(map(str, error["loc"]))
+    return f"{loc}: {error['msg']}" if loc else error["msg"]
+
+
+async def bulk_import(
+    lines: AsyncIterator[bytes | None], extra: dict, writer: EventWriter
+) -> dict:
+    """Validate NDJSON events line by line and insert them in fixed chunks.
+
+    Only one chunk is held at a time and each insert is awaited before more
+    of the body is read, so memory stays flat and the database sets the
+    pace. Raises `BulkWriteFailed` with the line to resume from if a chunk
+    is dropped; everything before that line has been written.
+    """
+    report = {"lines": 0, "accepted": 0, "rejected": 0, "errors": []}
+    chunk: List[dict] = []
+    chunk_start = 1
+
+    async def write():
+        if not await run_in_threadpool(writer.write, chunk):
+            raise BulkWriteFailed(report, chunk_start)
+        report["accepted"] += len(chunk)
+        chunk.clear()
+
+    async for line in lines:
+        report["lines"] += 1
+        number = report["lines"]
+
+        if line is not None and not line.strip():
+            continue
+
+        if line is None:
+            error = "line too long"
+        else:
+            try:
+                row = Event.model_validate_json(line).model_dump(mode="json")
+                error = None
+            except ValidationError as e:
+                error = line_error(e)
+
+        if error:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_BULK_ERRORS:
+                report["errors"].append({"line": number, "error": error})
+            continue
+
+        if not chunk:
+            chunk_start = number
+        row.update(extra)
+        chunk.append(row)
+
+        if len(chunk) >= BULK_CHUNK_ROWS:
+            await write()
+
+    if chunk:
+        await write()
+
+    return report
+
+
+def get_event_writer() -> EventWriter:
+    return event_writer
@@ -0,0 +1,312 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Tuple
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Histogram bucket bounds: seconds for latencies, bytes for payloads
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+UNMATCHED = "unmatched"
+PREFIX = "cloudboard"
+DB_STAGE = "db"  # recorded by core.dbtrace, once per PostgREST call
+
+# [seconds, count] per stage of the request being handled, for its
+# Server-Timing header
+_request_timings: ContextVar[Dict[str, list] | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram:
+    """Bucketed observations, rendered cumulatively as Prometheus expects"""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str) -> Iterable[str]:
+        sep = "," if labels else ""
+        total = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels}{sep}le="{bound}"}} {total}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {total}"
+
+
+def label(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def labels(**values) -> str:
+    return ",".join(f'{key}="{label(value)}"' for key, value in values.items())
+
+
+class Metrics:
+    """Per-route request metrics and per-stage timings.
+
+    Updated from the event loop (stage timers may also run in worker
+    threads); plain counters keep the per-request cost to a few dict
+    lookups, so it stays on for the tracking path.
+    """
+
+    def __init__(self):
+        self.durations: Dict[Tuple[str, str, int], Histogram] = {}
+        self.request_sizes: Dict[Tuple[str, str], Histogram] = {}
+        self.response_sizes: Dict[Tuple[str, str], Histogram] = {}
+        self.db_calls: Dict[Tuple[str, str], Histogram] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.stages: Dict[str, Histogram] = {}
+
+    def observe_request(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        seconds: float,
+        received: int,
+        sent: int,
+        db_calls: int,
+    ):
+        key = (method, route)
+        histogram = self.durations.get((method, route, status))
+        if histogram is None:
+            histogram = self.durations[(method, route, status)] = Histogram(
+                LATENCY_BUCKETS
+            )
+        histogram.observe(seconds)
+
+        for sizes, size in (
+            (self.request_sizes, received),
+            (self.response_sizes, sent),
+        ):
+            histogram = sizes.get(key)
+            if histogram is None:
+                histogram = sizes[key] = Histogram(SIZE_BUCKETS)
+            histogram.observe(size)
+
+        histogram = self.db_calls.get(key)
+        if histogram is None:
+            histogram = self.db_calls[key] = Histogram(CALL_BUCKETS)
+        histogram.observe(db_calls)
+
+    def observe_stage(self, stage: str, seconds: float):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def lines(self) -> Iterable[str]:
+        name = f"{PREFIX}_http_request_duration_seconds"
+        yield f"# HELP {name} Request latency by route"
+        yield f"# TYPE {name} histogram"
+        for (method, route, status), histogram in list(self.durations.items()):
+            yield from histogram.lines(
+                name, labels(method=method, route=route, status=status)
+            )
+
+        for kind, sizes in (
+            ("request", self.request_sizes),
+            ("response", self.response_sizes),
+        ):
+            name = f"{PREFIX}_http_{kind}_size_bytes"
+            yield f"# HELP {name} Body size on the wire by route"
+            yield f"# TYPE {name} histogram"
+            for (method, route), histogram in list(sizes.items()):
+                yield from histogram.lines(name, labels(method=method, route=route))
+
+        name = f"{PREFIX}_http_request_db_calls"
+        yield f"# HELP {name} Database calls made per request by route"
+        yield f"# TYPE {name} histogram"
+        for (method, route), histogram in list(self.db_calls.items()):
+            yield from histogram.lines(name, labels(method=method, route=route))
+
+        name = f"{PREFIX}_http_requests_in_flight"
+        yield f"# HELP {name} Requests being handled by route"
+        yield f"# TYPE {name} gauge"
+        for (method, route), count in list(self.in_flight.items()):
+            yield f"{name}{{{labels(method=method, route=route)}}} {count}"
+
+        name = f"{PREFIX}_stage_duration_seconds"
+        yield f"# HELP {name} Time spent in each instrumented stage"
+        yield f"# TYPE {name} histogram"
+        for stage, histogram in list(self.stages.items()):
+            yield from histogram.lines(name, labels(stage=stage))
+
+
+metrics = Metrics()
+
+
+def add_timing(stage: str, seconds: float):
+    """Record `seconds` spent in `stage`, in the stage histogram and, inside
+    a request, in its Server-Timing header"""
+    metrics.observe_stage(stage, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timing = timings.setdefault(stage, [0.0, 0])
+        timing[0] += seconds
+        timing[1] += 1
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a block as `stage`, see `add_timing`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(stage, time.perf_counter() - started)
+
+
+def server_timing(timings: Dict[str, list], total: float) -> str:
+    parts = [
+        (
+            f'{stage};desc="{count} calls";dur={seconds * 1000:.2f}'
+            if count > 1
+            else f"{stage};dur={seconds * 1000:.2f}"
+        )
+        for stage, (seconds, count) in timings.items()
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight requests and body sizes
+    per route template, and adding a `Server-Timing` header"""
+
+    def __init__(self, app: ASGIApp, routes: List = ()):
+        self.app = app
+        self.routes = routes
+
+    def route_of(self, scope: Scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return UNMATCHED
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        method = scope["method"]
+        route = self.route_of(scope)
+        key = (method, route)
+        timings: Dict[str, list] = {}
+        token = _request_timings.set(timings)
+        received = sent = 0
+        status = 500
+
+        async def counting_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def timing_send(message: Message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (
+                        b"server-timing",
+                        server_timing(timings, time.perf_counter() - started).encode(),
+                    )
+                )
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        metrics.in_flight[key] = metrics.in_flight.get(key, 0) + 1
+        try:
+            await self.app(scope, counting_receive, timing_send)
+        finally:
+            metrics.in_flight[key] -= 1
+            _request_timings.reset(token)
+            metrics.observe_request(
+                method,
+                route,
+                status,
+                time.perf_counter() - started,
+                received,
+                sent,
+                timings.get(DB_STAGE, (0.0, 0))[1],
+            )
+
+
+def cache_lines(caches: Iterable[dict]) -> Iterable[str]:
+    """`TTLCache.stats()` style dicts as Prometheus series"""
+    caches = list(caches)
+    for field, kind in (
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+        ("size", "gauge"),
+    ):
+        name = f"{PREFIX}_cache_{field}" + ("_total" if kind == "counter" else "")
+        yield f"# TYPE {name} {kind}"
+        for stats in caches:
+            if field in stats:
+                yield f"{name}{{{labels(cache=stats['name'])}}} {stats[field]}"
+
+
+def hashing_lines(stats: dict) -> Iterable[str]:
+    """`PasswordHasher.stats()` as Prometheus series"""
+    name = f"{PREFIX}_hashing_duration_seconds"
+    yield f"# TYPE {name} histogram"
+    total = 0
+    for bound, count in stats["buckets"].items():
+        total += count
+        yield f'{name}_bucket{{le="{bound}"}} {total}'
+    yield f"{name}_sum {stats['mean_seconds'] * stats['count']}"
+    yield f"{name}_count {stats['count']}"
+
+    for field, kind in (("pending", "gauge"), ("rejected", "counter")):
+        name = f"{PREFIX}_hashing_{field}" + ("_total" if kind == "counter" else "")
+        yield f"# TYPE {name} {kind}"
+        yield f"{name} {stats[field]}"
+
+
+def ingest_lines(writer) -> Iterable[str]:
+    """`EventWriter` queue depth and outcomes as Prometheus series"""
+    for field, kind, value in (
+        ("pending_rows", "gauge", writer.pending()),
+        ("flushed_rows", "counter", writer.flushed),
+        ("dropped_rows", "counter", writer.dropped),
+    ):
+        name = f"{PREFIX}_ingest_{field}" + ("_total" if kind == "counter" else "")
+        yield f"# TYPE {name} {kind}"
+        yield f"{name} {value}"
+
+
+def exposition(*sections: Iterable[str]) -> str:
+    return "\n".join(line for section in sections for line in section) + "\n"
@@ -0,0 +1,125 @@
+import logging
+from collections import Counter
+from typing import Iterable, List, Sequence, Tuple
+
+from core.background import PeriodicFlusher
+from core.responses import domain_scope, response_cache
+from database import db
+from utils import parse_db_datetime
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 60.0  # seconds
+# Pseudo pages, edges from ENTRANCE count entries and edges to EXIT exits
+ENTRANCE = "(entrance)"
+EXIT = "(exit)"
+
+
+def transitions(paths: Sequence[str]) -> Counter:
+    """from → to edges of one session's ordered pathnames, reloads and the
+    exit event's repeat of the last page collapsed"""
+    pages = [path for i, path in enumerate(paths) if i == 0 or path != paths[i - 1]]
+    if not pages:
+        return Counter()
+    return Counter(zip([ENTRANCE, *pages], [*pages, EXIT]))
+
+
+def day_bucket(timestamp: str) -> str:
+    return parse_db_datetime(timestamp).date().isoformat()
+
+
+class PathGraph(PeriodicFlusher):
+    """Page-transition counts per domain × day × from_path × to_path.
+
+    Fed with sessions as the sessionizer closes them (and by session
+    rebuilds), added to `path_edges` through the `increment_path_edges`
+    RPC. A session closed again after late events only contributes the
+    difference to what it already counted.
+    """
+
+    name = "paths"
+
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        super().__init__(interval)
+        self._counts: Counter = Counter()
+
+    def observe(self, sessions: Iterable):
+        """Sessionizer listener, receives the `OpenSession`s it closed"""
+        counts = Counter()
+        for session in sessions:
+            day = session.start.date().isoformat()
+            edges = Counter(
+                {
+                    (session.domain_id, day, *edge): count
+                    for edge, count in transitions(session.path_sequence()).items()
+                }
+            )
+            delta = edges.copy()
+            delta.subtract(session.counted_edges)
+            session.counted_edges = edges
+            counts.update({key: count for key, count in delta.items() if count})
+
+        self._add(counts)
+
+    def add_paths(self, sessions: Iterable[Tuple[int, str, List[str]]]):
+        """(domain_id, start, ordered pathnames) of rebuilt sessions"""
+        counts = Counter()
+        for domain_id, start, paths in sessions:
+            day = day_bucket(start)
+            for edge, count in transitions(paths).items():
+                counts[(domain_id, day, *edge)] += count
+
+        self._add(counts)
+
+    def _add(self, counts: Counter):
+        if not counts:
+            return
+        with self._lock:
+            self._counts.update(counts)
+        self._ensure_started()
+
+    def flush(self, final: bool = False):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+
+        rows = [
+            {
+                "domain_id": domain_id,
+                "day": day,
+                "from_path": from_path,
+                "to_path": to_path,
+                "count": count,
+            }
+            for (domain_id, day, from_path, to_path), count in counts.items()
+            if count
+        ]
+        if not rows:
+            return
+
+        try:
+            db().rpc("increment_path_edges", {"rows": rows}).execute()
+            response_cache.bump(*{domain_scope(row["domain_id"]) for row in rows})
+        except Exception:
+            logger.exception("increment of %d path edges failed", len(rows))
+            with self._lock:
+                self._counts.update(counts)
+
+
+def funnel_steps(paths: List[str], rows: List[dict]) -> List[dict]:
+    """Shape `path_funnel` rows, with each step's rate from the one before"""
+    counts = {row["step"]: row["count"] for row in rows}
+    steps = []
+    for step, path in enumerate(paths, start=1):
+        count = counts.get(step, 0)
+        previous = steps[-1]["count"] if steps else None
+        steps.append(
+            {
+                "path": path,
+                "count": count,
+                "rate": count / previous if previous else None,
+            }
+        )
+    return steps
+
+
+path_graph = PathGraph()
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Awaitable, Callable, List
+
+from fastapi import Request, Response
+
+from core.cache import TTLCache
+
+
+def domain_scope(domain_id: int) -> str:
+    return f"domain:{domain_id}"
+
+
+DOMAINS_SCOPE = "domains"
+SESSIONS_SCOPE = "sessions"
+
+
+class ResponseCache:
+    """Serialized GET responses with strong ETags and 304 support.
+
+    Entries are keyed by path, query string and the current version of a
+    scope (e.g. a domain). Bumping a scope's version makes every response
+    cached under it unreachable; they age out through LRU eviction.
+    """
+
+    def __init__(
+        self, maxsize: int = 512, ttl: float = 300.0, max_scopes: int = 10_000
+    ):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, name="responses")
+        self.max_scopes = max_scopes
+        # Versions come from one increasing clock, least recently bumped
+        # first. A forgotten scope reads as the newest version forgotten, so
+        # it never goes back to a version it had before a later bump.
+        self._versions: OrderedDict[str, int] = OrderedDict()
+        self._clock = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def version(self, scope: str) -> int:
+        return self._versions.get(scope, self._forgotten)
+
+    def bump(self, *scopes: str):
+        with self._lock:
+            for scope in scopes:
+                self._clock += 1
+                self._versions[scope] = self._clock
+                self._versions.move_to_end(scope)
+            while len(self._versions) > self.max_scopes:
+                _, version = self._versions.popitem(last=False)
+                self._forgotten = max(self._forgotten, version)
+
+    def bump_events(self, rows: List[dict]):
+        """`EventWriter` listener: invalidate the domains of rows once
+        they are written, not when they are queued, so a read in between
+        can't cache the old data under the new version"""
+        self.bump(*{domain_scope(row["domain_id"]) for row in rows})
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    async def respond(
+        self,
+        request: Request,
+        scope: str,
+        serialize: Callable[[Any], bytes],
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Response:
+        key = (
+            request.url.path,
+            tuple(sorted(request.query_params.multi_items())),
+            scope,
+            self.version(scope),
+        )
+
+        entry = self._cache.get(key)
+        if entry is None:
+            body = serialize(await compute())
+            entry = (f'"{sha256(body).hexdigest()[:32]}"', body)
+            self._cache.set(key, entry)
+
+        etag, body = entry
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        return Response(body, media_type="application/json", headers=headers)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,204 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import List
+from urllib.parse import urlparse
+
+from core.background import PeriodicFlusher
+from core.responses import domain_scope, response_cache
+from database import db
+from utils import parse_agent, parse_db_datetime
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 30.0  # seconds
+TOP_KEYS = 100  # elements / event types kept per domain and hour on each flush
+OTHER = "(other)"
+DIRECT = "(direct)"
+
+# Rollup dimensions: page views are counted per pathname, referrer host and
+# device/os/browser, clicks per element, and every event per event_type
+# (for /analytics/timeseries)
+PAGE_DIMENSIONS = ("pages", "referrers", "devices", "os", "browsers")
+CLICK_DIMENSION = "elements"
+EVENT_DIMENSION = "events"
+# Dimensions keyed by free-form client values, their tail is folded into OTHER
+TRIMMED_DIMENSIONS = (CLICK_DIMENSION, EVENT_DIMENSION)
+
+
+# /analytics/timeseries bucket widths, and the most buckets one chart may have
+# (90 days of hours fit, minutes are for ranges of a few days at most)
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+MAX_BUCKETS = 5000
+
+
+def hour_bucket(timestamp: str) -> str:
+    dt = parse_db_datetime(timestamp)
+    return dt.replace(minute=0, second=0, microsecond=0).isoformat()
+
+
+def referrer_host(referrer: str | None) -> str:
+    if not referrer:
+        return DIRECT
+    return urlparse(referrer).hostname or DIRECT
+
+
+class Rollups(PeriodicFlusher):
+    """Pre-aggregated event counts per domain × hour × dimension × key.
+
+    Tracked batches are folded into in-memory counters, which are added to
+    the `rollups` table through the `increment_rollups` RPC so concurrent
+    workers never overwrite each other's counts.
+    """
+
+    name = "rollups"
+
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        super().__init__(interval)
+        self._counts: Counter = Counter()
+
+    def observe(self, events: List[dict]):
+        counts = Counter()
+        for event in events:
+            domain_id = event["domain_id"]
+            bucket = hour_bucket(event["timestamp"])
+            counts[(domain_id, bucket, EVENT_DIMENSION, event["event_type"])] += 1
+
+            if event["event_type"] == "page_load":
+                agent = parse_agent(event["user_agent"])
+                keys = (
+                    event["pathname"],
+                    referrer_host(event.get("referrer")),
+                    agent["device"],
+                    agent["os"],
+                    agent["browser"],
+                )
+                for dimension, key in zip(PAGE_DIMENSIONS, keys):
+                    counts[(domain_id, bucket, dimension, key)] += 1
+
+            elif event["event_type"] == "click" and event.get("element"):
+                counts[(domain_id, bucket, CLICK_DIMENSION, event["element"])] += 1
+
+        with self._lock:
+            self._counts.update(counts)
+
+        self._ensure_started()
+
+    def flush(self, final: bool = False):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+
+        if not counts:
+            return
+
+        rows = [
+            {
+                "domain_id": domain_id,
+                "bucket": bucket,
+                "dimension": dimension,
+                "key": key,
+                "count": count,
+            }
+            for (domain_id, bucket, dimension, key), count in self._trim(counts).items()
+        ]
+
+        try:
+            db().rpc("increment_rollups", {"rows": rows}).execute()
+            # /analytics/timeseries responses are cached per domain
+            response_cache.bump(*{domain_scope(row["domain_id"]) for row in rows})
+        except Exception:
+            logger.exception("increment of %d rollup rows failed", len(rows))
+            with self._lock:
+                self._counts.update(counts)
+
+    @staticmethod
+    def _trim(counts: Counter) -> Counter:
+        """Fold the long tail of clicked elements and event types into OTHER"""
+        keys: dict = {}
+        for key, count in counts.items():
+            if key[2] in TRIMMED_DIMENSIONS:
+                keys.setdefault(key[:3], []).append((count, key))
+
+        for (domain_id, bucket, dimension), ranked in keys.items():
+            if len(ranked) <= TOP_KEYS:
+                continue
+            ranked.sort(reverse=True)
+            for count, key in ranked[TOP_KEYS:]:
+                del counts[key]
+                counts[(domain_id, bucket, dimension, OTHER)] += count
+
+        return counts
+
+
+def merge_summary(rows: List[dict]) -> dict:
+    """Shape `rollup_summary` rows into per-dimension rankings"""
+    summary = {dimension: [] for dimension in (*PAGE_DIMENSIONS, CLICK_DIMENSION)}
+    totals = {}
+    for row in rows:
+        if row["dimension"] == "total":
+            totals[row["key"]] = row["count"]
+        elif row["dimension"] in summary:
+            summary[row["dimension"]].append({"key": row["key"], "count": row["count"]})
+
+    for ranking in summary.values():
+        ranking.sort(key=lambda r: r["count"], reverse=True)
+
+    return {
+        "page_views": totals.get("pages", 0),
+        "clicks": totals.get(CLICK_DIMENSION, 0),
+        **summary,
+    }
+
+
+def as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def truncate(dt: datetime, granularity: str) -> datetime:
+    """Start of the UTC bucket holding `dt`"""
+    dt = as_utc(dt).replace(second=0, microsecond=0)
+    if granularity in ("hour", "day"):
+        dt = dt.replace(minute=0)
+    if granularity == "day":
+        dt = dt.replace(hour=0)
+    return dt
+
+
+def bucket_count(start: datetime, end: datetime, granularity: str) -> int:
+    return (as_utc(end) - truncate(start, granularity)) // GRANULARITIES[
+        granularity
+    ] + 1
+
+
+def dense_timeseries(
+    rows: List[dict], start: datetime, end: datetime, granularity: str
+) -> dict:
+    """Spread sparse `rollup_timeseries` rows over every bucket of the range,
+    empty buckets counting 0"""
+    step = GRANULARITIES[granularity]
+    first = truncate(start, granularity)
+    count = bucket_count(start, end, granularity)
+
+    events = [0] * count
+    sessions = [0] * count
+    for row in rows:
+        index = (parse_db_datetime(row["bucket"]) - first) // step
+        if 0 <= index < count:
+            events[index] += row["events"]
+            sessions[index] += row["sessions"]
+
+    return {
+        "granularity": granularity,
+        "buckets": [first + step * i for i in range(count)],
+        "events": events,
+        "sessions": sessions,
+    }
+
+
+rollups = Rollups()
@@ -0,0 +1,224 @@
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+
+from core.background import PeriodicFlusher
+from core.cache import TTLCache
+from core.responses import SESSIONS_SCOPE, domain_scope, response_cache
+from database import db
+from utils import parse_agent, parse_db_datetime
+
+logger = logging.getLogger(__name__)
+
+SESSION_TIMEOUT = 30 * 60  # seconds of inactivity before a session is closed
+SWEEP_INTERVAL = 60.0  # seconds between upserts of changed sessions
+MAX_FLUSH_FAILURES = 3  # failed upserts before a closed session is dropped
+# Sessions whose last event is more recent may still be open in some
+# worker's sessionizer, which will merge them (with a margin for sweeps and
+# client clocks). Rebuilds from the events table leave them alone.
+LIVE_WINDOW = timedelta(seconds=SESSION_TIMEOUT + 2 * SWEEP_INTERVAL)
+
+
+def is_live(end: datetime) -> bool:
+    return end > datetime.now(timezone.utc) - LIVE_WINDOW
+
+
+PATH_EVENTS = ("page_load", "exit")
+
+
+class OpenSession:
+    """Running aggregate of one session, updated event by event"""
+
+    __slots__ = (
+        "session_id",
+        "domain_id",
+        "user_id",
+        "start",
+        "end",
+        "event_count",
+        "agent",
+        "entry_at",
+        "entry_path",
+        "exit_at",
+        "exit_path",
+        "paths",
+        "counted_edges",
+        "flushed_events",
+        "failures",
+        "last_seen",
+        "dirty",
+    )
+
+    def __init__(self, event: dict):
+        timestamp = parse_db_datetime(event["timestamp"])
+        self.session_id = event["session_id"]
+        self.domain_id = event["domain_id"]
+        self.user_id = event.get("user_id")
+        self.start = timestamp
+        self.end = timestamp
+        self.event_count = 0
+        self.agent = parse_agent(event["user_agent"])
+        self.entry_at: datetime | None = None
+        self.entry_path: str | None = None
+        self.exit_at: datetime | None = None
+        self.exit_path: str | None = None
+        self.paths: List[tuple] = []
+        self.counted_edges: Counter = Counter()  # see core.paths
+        self.flushed_events = 0  # event_count already merged into the table
+        self.failures = 0
+        self.last_seen = time.monotonic()
+        self.dirty = True
+
+    def add(self, event: dict):
+        timestamp = parse_db_datetime(event["timestamp"])
+        self.start = min(self.start, timestamp)
+        self.end = max(self.end, timestamp)
+        self.event_count += 1
+
+        if event["event_type"] in PATH_EVENTS and event.get("pathname"):
+            self.paths.append((timestamp, event["pathname"]))
+            if self.entry_at is None or timestamp < self.entry_at:
+                self.entry_at = timestamp
+                self.entry_path = event["pathname"]
+            if self.exit_at is None or timestamp >= self.exit_at:
+                self.exit_at = timestamp
+                self.exit_path = event["pathname"]
+
+        self.last_seen = time.monotonic()
+        self.dirty = True
+
+    def path_sequence(self) -> List[str]:
+        """Pathnames of the session's page events in time order"""
+        return [path for _, path in sorted(self.paths, key=lambda p: p[0])]
+
+    def to_row(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "domain_id": self.domain_id,
+            "user_id": self.user_id,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "duration": (self.end - self.start).total_seconds(),
+            "event_count": self.event_count,
+            "device": self.agent["device"],
+            "os": self.agent["os"],
+            "browser": self.agent["browser"],
+            "entry_path": self.entry_path,
+            "exit_path": self.exit_path,
+        }
+
+
+class Sessionizer(PeriodicFlusher):
+    """Maintains sessions incrementally from the tracked event stream.
+
+    Hooked to the event writer, it keeps one `OpenSession` per session_id,
+    merges changed sessions into `sessions` every `sweep_interval` and
+    closes them after `timeout` seconds without events. Recently closed
+    sessions are remembered so late events extend them instead of starting
+    over.
+
+    Rows go through the `merge_sessions` RPC with the events counted since
+    the last flush, so the parts of a session seen by different workers
+    (or after it was forgotten) add up instead of overwriting each other.
+    """
+
+    name = "sessionizer"
+
+    def __init__(
+        self,
+        rpc: str = "merge_sessions",
+        timeout: float = SESSION_TIMEOUT,
+        sweep_interval: float = SWEEP_INTERVAL,
+    ):
+        super().__init__(sweep_interval)
+        self.rpc = rpc
+        self.timeout = timeout
+
+        self._open: Dict[str, OpenSession] = {}
+        self._closed = TTLCache(maxsize=50_000, ttl=6 * 3600, name="closed_sessions")
+        self._listeners: List[Callable[[List[OpenSession]], None]] = []
+
+    def add_listener(self, listener: Callable[[List[OpenSession]], None]):
+        """Run `listener` with the sessions closed on each sweep"""
+        self._listeners.append(listener)
+
+    def observe(self, events: List[dict]):
+        with self._lock:
+            for event in events:
+                session_id = event["session_id"]
+                session = self._open.get(session_id)
+                if session is None:
+                    session = self._closed.pop(session_id) or OpenSession(event)
+                    self._open[session_id] = session
+                session.add(event)
+
+        self._ensure_started()
+
+    def open_sessions(self) -> int:
+        return len(self._open)
+
+    def flush(self, final: bool = False):
+        """Merge changed sessions into the table and close the idle ones"""
+        now = time.monotonic()
+        with self._lock:
+            changed = [s for s in self._open.values() if s.dirty]
+            counts = [s.event_count for s in changed]
+            rows = []
+            for session in changed:
+                row = session.to_row()
+                row["event_count"] -= session.flushed_events
+                rows.append(row)
+                session.dirty = False
+
+            idle = [
+                s
+                for s in self._open.values()
+                if final or now - s.last_seen >= self.timeout
+            ]
+            for session in idle:
+                del self._open[session.session_id]
+                self._closed.set(session.session_id, session)
+
+        if idle:
+            for listener in self._listeners:
+                try:
+                    listener(idle)
+                except Exception:
+                    logger.exception("session listener %r failed", listener)
+
+        if not rows:
+            return
+
+        try:
+            db().rpc(self.rpc, {"rows": rows}).execute()
+        except Exception:
+            logger.exception("merge of %d sessions failed", len(rows))
+            dropped = 0
+            with self._lock:
+                for session in changed:
+                    session.dirty = True
+                    session.failures += 1
+                # Closed sessions are retried a few times, then given up on
+                # so a database outage can't grow _open without bound
+                for session in idle:
+                    if session.failures >= MAX_FLUSH_FAILURES:
+                        self._closed.pop(session.session_id)
+                        dropped += 1
+                    else:
+                        self._open.setdefault(session.session_id, session)
+            if dropped:
+                logger.error("dropped %d sessions after repeated failures", dropped)
+            return
+
+        with self._lock:
+            for session, count in zip(changed, counts):
+                session.flushed_events = count
+                session.failures = 0
+        response_cache.bump(
+            SESSIONS_SCOPE, *{domain_scope(row["domain_id"]) for row in rows}
+        )
+
+
+sessionizer = Sessionizer()
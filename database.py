@@ -1,11 +1,68 @@
-from supabase import create_client, Client
+import httpx
+from postgrest import AsyncPostgrestClient, SyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
 from config import config
+from core.dbtrace import tracer
 
 url = config.DB_URL
 key = config.DB_KEY
+# Every call through either client is timed and counted, see core.dbtrace
+tracer.install()
 
-supabase: Client = create_client(url, key)
+headers = {
+    **DEFAULT_POSTGREST_CLIENT_HEADERS,
+    "apikey": key,
+    "Authorization": f"Bearer {key}",
+}
 
+# Sync client, kept for code running off the event loop (background writers).
+# Created on first use: the full supabase client also loads auth, storage
+# and realtime, none of which is used, so only its PostgREST part is built.
+supabase: SyncPostgrestClient | None = None
+
+_async_client: AsyncPostgrestClient | None = None
+
+
+def db() -> SyncPostgrestClient:
+    global supabase
+
+    if supabase is None:
+        http_client = httpx.Client(
+            headers=headers, timeout=config.DB_TIMEOUT, follow_redirects=True
+        )
+        supabase = SyncPostgrestClient(
+            f"{url}/rest/v1", headers=headers, http_client=http_client
+        )
 
-def db() -> Client:
     return supabase
+
+
+def adb() -> AsyncPostgrestClient:
+    """Shared async PostgREST client over one keep-alive HTTP/2 pool"""
+    global _async_client
+
+    if _async_client is None:
+        http_client = httpx.AsyncClient(
+            headers=headers,
+            http2=True,
+            timeout=config.DB_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=config.DB_POOL_SIZE,
+                max_keepalive_connections=config.DB_POOL_KEEPALIVE,
+                keepalive_expiry=30.0,
+            ),
+        )
+        _async_client = AsyncPostgrestClient(
+            f"{url}/rest/v1", headers=headers, http_client=http_client
+        )
+
+    return _async_client
+
+
+async def close_adb():
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -1,12 +1,56 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import domains, events, auth, users, analytics
+from core.ingest import event_writer
+from core.paths import path_graph
+from core.rollups import rollups
+from core.sessions import sessionizer
+from core.uniques import uniques
+from database import close_adb
+from core.agents import agent_parser
+from core.assets import tracker
+from core.dbtrace import tracer
+from core.hashing import password_hasher
+from core.metrics import (
+    MetricsMiddleware,
+    cache_lines,
+    exposition,
+    hashing_lines,
+    ingest_lines,
+    metrics,
+)
+from core.responses import response_cache
+from utils import api_key_cache, domain_cache
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    event_writer.add_listener(response_cache.bump_events)
+    # Bulk imports skip the sessionizer, their sessions are rebuilt from the
+    # events by /analytics/sessions
+    event_writer.add_listener(sessionizer.observe, live_only=True)
+    event_writer.add_listener(rollups.observe)
+    event_writer.add_listener(uniques.observe)
+    sessionizer.add_listener(path_graph.observe)
+    tracker.load()
+    yield
+    # Write whatever /events/track still has queued before the worker exits
+    event_writer.stop()
+    sessionizer.stop()
+    path_graph.stop()
+    rollups.stop()
+    uniques.stop()
+    await close_adb()
+    password_hasher.shutdown()
+
+
 app = FastAPI(
     title="Cloudboard API",
+    lifespan=lifespan,
 )
 
 timestamp = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
@@ -24,7 +68,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
+app.add_middleware(MetricsMiddleware, routes=app.router.routes)
 
 
 app.include_router(events.router)
@@ -44,9 +90,61 @@ def welcome():
     }
 
 
-@app.get("/tracker.js", response_class=FileResponse)
-async def get_tracker():
+@app.get("/cache")
+def cache_stats():
+    """Hit/miss counters for the in-process lookup caches"""
+    return {
+        "caches": [
+            api_key_cache.stats(),
+            domain_cache.stats(),
+            agent_parser.stats(),
+            response_cache.stats(),
+        ]
+    }
+
+
+@app.get("/hashing")
+def hashing_stats():
+    """Queue depth and latency of the password hashing pool"""
+    return password_hasher.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Route latencies, stage timings, database calls, caches, hashing pool
+    and ingest queue in the Prometheus text format"""
+    return PlainTextResponse(
+        exposition(
+            metrics.lines(),
+            tracer.lines(),
+            cache_lines(
+                [
+                    api_key_cache.stats(),
+                    domain_cache.stats(),
+                    agent_parser.stats(),
+                    response_cache.stats(),
+                ]
+            ),
+            hashing_lines(password_hasher.stats()),
+            ingest_lines(event_writer),
+        ),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/tracker")
+def tracker_version():
+    """Current tracker build and its immutable URL, for embed snippets"""
+    return tracker.stats()
+
+
+@app.get("/tracker.js")
+async def get_tracker(request: Request):
     """Serve the tracker file to authoriced domains"""
-    headers = {"Cache-Control": "public, max-age=86400"}
-    file_path = BASE_DIR / "static" / "tracker.js"
-    return FileResponse(file_path, media_type="application/javascript", headers=headers)
+    return tracker.respond(request)
+
+
+@app.get("/tracker.{version}.js")
+async def get_versioned_tracker(version: str, request: Request):
+    """Content-hashed tracker, cacheable forever"""
+    return tracker.respond(request, version)
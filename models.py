@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 from pydantic.v1 import BaseConfig as BaseConfig  # type: ignore[assignment]
 from pydantic import BaseModel, EmailStr
 
@@ -46,7 +46,7 @@ class User(BaseModel):
 class UserData(BaseModel):
     id: int
     email: EmailStr
-    password: str
+    password: str | None = None
 
 
 class ApiKey(BaseModel):
@@ -104,3 +104,50 @@ class Session(BaseModel):
 class DateRange(BaseModel):
     start: datetime
     end: datetime
+
+
+class RollupCount(BaseModel):
+    key: str
+    count: int
+
+
+class Timeseries(BaseModel):
+    granularity: Literal["minute", "hour", "day"]
+    event_type: str | None
+    buckets: List[datetime]
+    events: List[int]
+    sessions: List[int]
+
+
+class Uniques(BaseModel):
+    pathname: str | None
+    uniques: int
+    standard_error: float
+
+
+class PathNeighbors(BaseModel):
+    path: str
+    direction: Literal["next", "previous"]
+    total: int
+    paths: List[RollupCount]
+
+
+class FunnelStep(BaseModel):
+    path: str
+    count: int
+    rate: float | None
+
+
+class Funnel(BaseModel):
+    steps: List[FunnelStep]
+
+
+class Summary(BaseModel):
+    page_views: int
+    clicks: int
+    pages: List[RollupCount]
+    referrers: List[RollupCount]
+    devices: List[RollupCount]
+    os: List[RollupCount]
+    browsers: List[RollupCount]
+    elements: List[RollupCount]
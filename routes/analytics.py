@@ -1,29 +1,74 @@
 from datetime import datetime
-from typing import List
-from fastapi import APIRouter, Depends, Query, status, HTTPException
-from database import db
-from models import DomainData, Session
+from typing import List, Literal
+
+import orjson
+from fastapi import APIRouter, Depends, Query, Request, status, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from core.paths import ENTRANCE, EXIT, funnel_steps, path_graph
+from core.responses import SESSIONS_SCOPE, domain_scope, response_cache
+from core.hll import standard_error
+from core.serialization import dump_rows
+from core.sessions import is_live
+from core.uniques import ALL, PAGES, PRECISIONS, VISITORS, decode_sketch
+from core.rollups import (
+    MAX_BUCKETS,
+    bucket_count,
+    dense_timeseries,
+    merge_summary,
+)
+from database import adb
+from models import (
+    DomainData,
+    Funnel,
+    PathNeighbors,
+    Session,
+    Summary,
+    Timeseries,
+    Uniques,
+)
 from utils import (
     build_session,
-    get_domain,
+    chunked,
+    get_paths,
+    group_session_events,
+    owned_domain,
+    parse_db_datetime,
     require_user_session,
-    sort_events_by_session,
-    sort_events_by_time,
+    scan_events,
 )
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
 
+SESSION_INSERT_CHUNK = 500
+
 
 @router.get("/sessions", response_model=List[Session])
-def get_sessions(
+async def get_sessions(
+    request: Request,
     user=Depends(require_user_session),
-    domain: DomainData = Depends(get_domain),
+    domain: DomainData = Depends(owned_domain),
     start: datetime = Query(...),
     end: datetime = Query(...),
 ):
 
+    return await response_cache.respond(
+        request,
+        domain_scope(domain.id),
+        dump_sessions,
+        lambda: load_sessions(domain, start, end),
+    )
+
+
+def dump_sessions(sessions: List[dict]) -> bytes:
+    return dump_rows(sessions, Session)
+
+
+async def load_sessions(domain: DomainData, start: datetime, end: datetime):
+
+    # Sessions are maintained at ingestion time by core.sessions, so this is
+    # normally the only query. The rebuild below covers older event ranges.
     existing = (
-        db()
+        await adb()
         .table("sessions")
         .select("*")
         .eq("domain_id", domain.id)
@@ -35,41 +80,271 @@ def get_sessions(
     if existing:
         return existing
 
-    events = (
-        db()
-        .table("events")
-        .select("*")
-        .eq("domain", domain.domain)
-        .gte("timestamp", start)
-        .lte("timestamp", end)
-        .execute()
-    ).data
+    new_sessions = []
+    groups = group_session_events(scan_events(domain.domain, start, end))
+    async for batch in chunked(groups, SESSION_INSERT_CHUNK):
+        sessions = await run_in_threadpool(list, map(build_session, batch))
+        # Rebuilt from this range's events only: never overwrite a stored
+        # session, which may extend past the range, nor store one the
+        # sessionizer may still be merging
+        settled = [s for s in sessions if not is_live(parse_db_datetime(s["end"]))]
+        inserted = []
+        if settled:
+            inserted = (
+                await adb()
+                .table("sessions")
+                .upsert(settled, on_conflict="session_id", ignore_duplicates=True)
+                .execute()
+            ).data
+        # Only sessions stored for the first time add their page transitions,
+        # the others were counted by the sessionizer or an earlier rebuild
+        stored = {row["session_id"] for row in inserted or []}
+        path_graph.add_paths(
+            (session["domain_id"], session["start"], get_paths(events))
+            for session, events in zip(sessions, batch)
+            if session["session_id"] in stored
+        )
+        new_sessions.extend(sessions)
 
-    if not events:
+    if not new_sessions:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"no session found in {domain.domain} between {start} and {end}",
         )
 
-    sessions = sort_events_by_session(events)
-    new_sessions = []
-    for session_events in sessions.values():
-        sorted_by_time = sort_events_by_time(session_events)
-        new_sessions.append(build_session(sorted_by_time))
-
-    recorded_sessions = db().table("sessions").insert(new_sessions).execute()
-
     return new_sessions
 
 
 @router.get("/session{session_id}", response_model=List[Session])
-def get_session(session_id: str, user=Depends(require_user_session)):
+async def get_session(
+    request: Request, session_id: str, user=Depends(require_user_session)
+):
+
+    async def load_session():
+        session = (
+            await adb()
+            .table("sessions")
+            .select("*")
+            .eq("session_id", session_id)
+            .execute()
+        ).data
 
-    session = (
-        db().table("sessions").select("*").eq("session_id", session_id).execute()
+        if not session:
+            raise HTTPException(404, "session not found")
+
+        return session
+
+    return await response_cache.respond(
+        request, SESSIONS_SCOPE, dump_sessions, load_session
+    )
+
+
+@router.get("/summary", response_model=Summary)
+async def get_summary(
+    user=Depends(require_user_session),
+    domain: DomainData = Depends(owned_domain),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    top: int = Query(10, ge=1, le=100),
+):
+
+    rows = (
+        await adb()
+        .rpc(
+            "rollup_summary",
+            {
+                "p_domain_id": domain.id,
+                "p_start": start.isoformat(),
+                "p_end": end.isoformat(),
+                "p_top": top,
+            },
+        )
+        .execute()
     ).data
 
-    if not session:
-        raise HTTPException(404, "session not found")
+    return merge_summary(rows or [])
+
+
+@router.get("/timeseries", response_model=Timeseries)
+async def get_timeseries(
+    request: Request,
+    user=Depends(require_user_session),
+    domain: DomainData = Depends(owned_domain),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    granularity: Literal["minute", "hour", "day"] = "hour",
+    event_type: str | None = None,
+):
+    """Event and session counts for every UTC bucket between start and end,
+    as parallel arrays with zeros for empty buckets"""
+
+    if end < start:
+        raise HTTPException(400, "end must not be before start")
+    if bucket_count(start, end, granularity) > MAX_BUCKETS:
+        raise HTTPException(
+            400, f"more than {MAX_BUCKETS} buckets, use a coarser granularity"
+        )
+
+    async def load_timeseries():
+        rows = (
+            await adb()
+            .rpc(
+                "rollup_timeseries",
+                {
+                    "p_domain_id": domain.id,
+                    "p_start": start.isoformat(),
+                    "p_end": end.isoformat(),
+                    "p_granularity": granularity,
+                    "p_event_type": event_type,
+                },
+            )
+            .execute()
+        ).data
+
+        return {
+            **dense_timeseries(rows or [], start, end, granularity),
+            "event_type": event_type,
+        }
+
+    return await response_cache.respond(
+        request, domain_scope(domain.id), orjson.dumps, load_timeseries
+    )
+
+
+@router.get("/uniques", response_model=Uniques)
+async def get_uniques(
+    request: Request,
+    user=Depends(require_user_session),
+    domain: DomainData = Depends(owned_domain),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    pathname: str | None = None,
+):
+    """Estimated distinct sessions between start and end, on the whole
+    domain or on one page, from the hourly HyperLogLog sketches (start is
+    rounded down to the hour). `standard_error` is relative: about 68% of
+    answers are within one, 99.7% within three."""
+
+    if end < start:
+        raise HTTPException(400, "end must not be before start")
+
+    dimension, key = (VISITORS, ALL) if pathname is None else (PAGES, pathname)
+
+    async def load_uniques():
+        merged = (
+            await adb()
+            .rpc(
+                "union_sketches",
+                {
+                    "p_domain_id": domain.id,
+                    "p_start": start.isoformat(),
+                    "p_end": end.isoformat(),
+                    "p_dimension": dimension,
+                    "p_key": key,
+                },
+            )
+            .execute()
+        ).data
+        sketch = decode_sketch(merged)
+
+        return {
+            "pathname": pathname,
+            "uniques": sketch.estimate() if sketch else 0,
+            "standard_error": standard_error(PRECISIONS[dimension]),
+        }
+
+    return await response_cache.respond(
+        request, domain_scope(domain.id), orjson.dumps, load_uniques
+    )
+
+
+@router.get("/paths", response_model=PathNeighbors)
+async def get_path_neighbors(
+    request: Request,
+    user=Depends(require_user_session),
+    domain: DomainData = Depends(owned_domain),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    from_path: str | None = None,
+    to_path: str | None = None,
+    top: int = Query(10, ge=1, le=100),
+):
+    """Most common next pages after `from_path`, or previous pages before
+    `to_path`. Without either, the entry pages; `to_path=(exit)` gives the
+    exit pages. Counted per UTC day from the sessions' page transitions."""
+
+    if from_path is not None and to_path is not None:
+        raise HTTPException(400, "pass either from_path or to_path, not both")
+    if end < start:
+        raise HTTPException(400, "end must not be before start")
+
+    forward = to_path is None
+    path = (from_path or ENTRANCE) if forward else to_path
+
+    async def load_paths():
+        rows = (
+            await adb()
+            .rpc(
+                "path_neighbors",
+                {
+                    "p_domain_id": domain.id,
+                    "p_start": start.date().isoformat(),
+                    "p_end": end.date().isoformat(),
+                    "p_path": path,
+                    "p_forward": forward,
+                    "p_top": top,
+                },
+            )
+            .execute()
+        ).data or []
+
+        return {
+            "path": path,
+            "direction": "next" if forward else "previous",
+            "total": rows[0]["total"] if rows else 0,
+            "paths": [{"key": row["path"], "count": row["count"]} for row in rows],
+        }
+
+    return await response_cache.respond(
+        request, domain_scope(domain.id), orjson.dumps, load_paths
+    )
+
+
+@router.get("/paths/funnel", response_model=Funnel)
+async def get_funnel(
+    request: Request,
+    user=Depends(require_user_session),
+    domain: DomainData = Depends(owned_domain),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    steps: List[str] = Query(..., min_length=2, max_length=10),
+):
+    """Sessions reaching each page of `steps` straight from the previous
+    one. Built from page transitions, so a step counts visitors coming
+    from the previous page, not necessarily through all earlier steps."""
+
+    if end < start:
+        raise HTTPException(400, "end must not be before start")
+    if ENTRANCE in steps[1:] or EXIT in steps[:-1]:
+        raise HTTPException(400, f"{ENTRANCE} can only start and {EXIT} end a funnel")
+
+    async def load_funnel():
+        rows = (
+            await adb()
+            .rpc(
+                "path_funnel",
+                {
+                    "p_domain_id": domain.id,
+                    "p_start": start.date().isoformat(),
+                    "p_end": end.date().isoformat(),
+                    "p_steps": steps,
+                },
+            )
+            .execute()
+        ).data
+
+        return {"steps": funnel_steps(steps, rows or [])}
 
-    return session
+    return await response_cache.respond(
+        request, domain_scope(domain.id), orjson.dumps, load_funnel
+    )
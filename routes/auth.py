@@ -1,29 +1,36 @@
 from typing import Annotated
 from fastapi import APIRouter, Body, Request, Response, status, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from database import db
+from database import adb
 from models import ApiKey, Domain, User, UserData, RefreshToken
 from config import config
 from utils import (
     generate_api_key,
     get_domain,
-    hash_password,
-    verify_password,
+    hash_password_async,
+    verify_password_async,
     create_access_token,
     get_user,
     get_domain,
     hash_token,
     create_refresh_token,
-    verify_refresh_token_db,
     refresh_expire_time,
     store_refresh_token_db,
-    revoke_refresh_token_db,
+    revoke_user_token_db,
+    revoke_user_tokens_db,
+    rotate_refresh_token_db,
+    require_user_session,
     generate_api_key,
     hash_api_key,
+    invalidate_api_keys,
+    invalidate_user_tokens,
 )
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
+# The refresh cookie is sent to /auth/refresh and /auth/logout
+REFRESH_COOKIE_PATH = "/auth"
+
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(credentials: Annotated[OAuth2PasswordRequestForm, Depends()]):
@@ -36,14 +43,15 @@ async def register(credentials: Annotated[OAuth2PasswordRequestForm, Depends()])
         )
 
     new_user = User(
-        email=credentials.username, password=hash_password(credentials.password)
+        email=credentials.username,
+        password=await hash_password_async(credentials.password),
     )
 
     created_user = (
-        db().table("users").insert(new_user.model_dump(exclude={"id"})).execute()
+        await adb().table("users").insert(new_user.model_dump(exclude={"id"})).execute()
     ).data[0]
 
-    user_token = create_access_token(data={"email": created_user["email"]})
+    user_token = create_access_token(created_user["id"], created_user["email"])
 
     return {
         "token": user_token,
@@ -62,14 +70,14 @@ async def login(
             status_code=status.HTTP_403_FORBIDDEN, detail="invalid credentials"
         )
 
-    verified = verify_password(credentials.password, user.password)
+    verified = await verify_password_async(credentials.password, user.password)
 
     if not verified:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="invalid credentials"
         )
 
-    access = create_access_token(user.id)
+    access = create_access_token(user.id, user.email)
     refresh = create_refresh_token()
     token_hash = hash_token(refresh)
 
@@ -80,7 +88,7 @@ async def login(
             "expires_at": refresh_expire_time(),
         }
     ).model_dump(mode="json")
-    store_refresh_token_db(token_data)
+    await store_refresh_token_db(token_data)
 
     response.set_cookie(
         key="refresh_token",
@@ -88,7 +96,7 @@ async def login(
         httponly=True,
         secure=True,
         samesite="lax",
-        path="/auth/refresh",
+        path=REFRESH_COOKIE_PATH,
     )
 
     return {"token": access}
@@ -96,25 +104,29 @@ async def login(
 
 @router.post("/logout", status_code=status.HTTP_201_CREATED)
 async def logout(
-    credentials: Annotated[OAuth2PasswordRequestForm, Depends()], response: Response
+    request: Request, response: Response, user=Depends(require_user_session)
 ):
-    session_id = get_user(email=credentials.username)
-
-    revoke_refresh_token_db(session_id.id)
 
-    response.delete_cookie(key="refresh_token", path="/auth/refresh")
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        await revoke_user_token_db(user.id, refresh_token)
+    else:
+        # No cookie to tell which session this is (e.g. one still scoped
+        # to /auth/refresh), end them all rather than none
+        await revoke_user_tokens_db(user.id)
+    invalidate_user_tokens(user.id)
+
+    response.delete_cookie(key="refresh_token", path=REFRESH_COOKIE_PATH)
     return {"ok": True}
 
 
 @router.post("/logout-all", status_code=status.HTTP_201_CREATED)
-async def logout(
-    credentials: Annotated[OAuth2PasswordRequestForm, Depends()], response: Response
-):
-    session_id = get_user(email=credentials.username)
+async def logout_all(response: Response, user=Depends(require_user_session)):
 
-    revoke_refresh_token_db(session_id.id)
+    await revoke_user_tokens_db(user.id)
+    invalidate_user_tokens(user.id)
 
-    response.delete_cookie(key="refresh_token", path="/auth/refresh")
+    response.delete_cookie(key="refresh_token", path=REFRESH_COOKIE_PATH)
     return {"ok": True}
 
 
@@ -126,25 +138,12 @@ async def refresh(request: Request, response: Response):
     if not refresh_token:
         raise HTTPException(status_code=401, detail="Missing refresh token")
 
-    record = verify_refresh_token_db(refresh_token)
-    if not record:
-        raise HTTPException(status_code=401, detail="invalid refresh token")
-
-    revoke_refresh_token_db(record["id"])
-
     new_refresh = create_refresh_token()
-    token_hash = hash_token(new_refresh)
-
-    token_data = RefreshToken(
-        **{
-            "user_id": record["user_id"],
-            "token_hash": token_hash,
-            "expires_at": refresh_expire_time(),
-        }
-    ).model_dump(mode="json")
-    store_refresh_token_db(token_data)
+    user = await rotate_refresh_token_db(refresh_token, new_refresh)
+    if not user:
+        raise HTTPException(status_code=401, detail="invalid refresh token")
 
-    new_access = create_access_token(record["user_id"])
+    new_access = create_access_token(user.id, user.email)
 
     response.set_cookie(
         key="refresh_token",
@@ -152,7 +151,7 @@ async def refresh(request: Request, response: Response):
         httponly=True,
         secure=True,
         samesite="lax",
-        path="/auth/refresh",
+        path=REFRESH_COOKIE_PATH,
     )
 
     return {"token": new_access}
@@ -163,7 +162,7 @@ async def get_api_key(domain: str = Body(..., embed=True)):
     new_api_key = generate_api_key(domain)
     hashed_key = hash_api_key(new_api_key)
 
-    key_domain = get_domain(domain)
+    key_domain = await get_domain(domain)
 
     if not key_domain:
         raise HTTPException(status_code=404, detail="domain not found")
@@ -179,7 +178,7 @@ async def get_api_key(domain: str = Body(..., embed=True)):
         }
     ).model_dump()
 
-    store_new_key = (db().table("api_keys").insert(key_data).execute()).data[0]
+    store_new_key = (await adb().table("api_keys").insert(key_data).execute()).data[0]
 
     if not store_new_key:
         raise HTTPException(
@@ -190,27 +189,39 @@ async def get_api_key(domain: str = Body(..., embed=True)):
 
 
 @router.post("/new/API-key", status_code=status.HTTP_201_CREATED)
-async def get_api_key(domain: str = Body(..., embed=True)):
+async def renew_api_key(
+    domain: str = Body(..., embed=True), user=Depends(require_user_session)
+):
     new_api_key = generate_api_key(domain)
     hashed_key = hash_api_key(new_api_key)
 
-    key_domain = get_domain(domain)
+    key_domain = await get_domain(domain)
 
     if not key_domain:
         raise HTTPException(status_code=404, detail="domain not found")
 
+    if key_domain.owner_id != user.id:
+        raise HTTPException(403, "Not authorized")
+
     if not key_domain.is_active:
         raise HTTPException(status_code=403, detail="domain is not active")
 
+    # Issuing a new key rotates out the previous ones for this domain
+    await adb().table("api_keys").update({"revoked": True}).eq("domain", domain).eq(
+        "revoked", False
+    ).execute()
+    invalidate_api_keys(domain)
+
     key_data = ApiKey(
         **{
             "domain_id": key_domain.id,
             "domain": domain,
             "key_hash": hashed_key,
+            "revoked": False,
         }
     ).model_dump()
 
-    store_new_key = (db().table("api_keys").insert(key_data).execute()).data[0]
+    store_new_key = (await adb().table("api_keys").insert(key_data).execute()).data[0]
 
     if not store_new_key:
         raise HTTPException(
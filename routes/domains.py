@@ -1,39 +1,65 @@
 from typing import List
-from fastapi import APIRouter, Depends, status, HTTPException, Query
-from database import db
+from fastapi import APIRouter, Depends, Request, status, HTTPException, Query
+from core.responses import DOMAINS_SCOPE, response_cache
+from core.serialization import dump_rows
+from database import adb
 from models import Domain, UserData
-from utils import require_user_session
+from utils import invalidate_domain, require_user_session
 
 router = APIRouter(prefix="/domains", tags=["Domains"])
 
 
 @router.get("/", response_model=List[Domain])
-def get_domains():
+async def get_domains(request: Request):
 
-    responce = (
-        db().table("domains").select("*").execute()
-    ).data
+    async def load_domains():
+        responce = (await adb().table("domains").select("*").execute()).data
+
+        if not responce:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="no domains found"
+            )
+        else:
+            domains = responce
+
+        return domains
+
+    return await response_cache.respond(
+        request, DOMAINS_SCOPE, lambda rows: dump_rows(rows, Domain), load_domains
+    )
+
+
+@router.get("/domain/{id}", response_model=Domain)
+async def get_domain(id: int, user=Depends(require_user_session)):
+
+    responce = (await adb().table("domains").select("*").eq("id", id).execute()).data
 
     if not responce:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="no domains found"
+            status_code=status.HTTP_404_NOT_FOUND, detail="domain not found"
         )
     else:
-        domains = responce
+        domain = responce[0]
 
-    return domains
+    return domain
 
 
-@router.get("/domain/{id}", response_model=Domain)
-def get_domain(id: int, user=Depends(require_user_session)):
+@router.patch("/domain/{id}/deactivate", response_model=Domain)
+async def deactivate_domain(id: int, user=Depends(require_user_session)):
 
-    responce = (db().table("domains").select("*").eq("id", id).execute()).data
+    responce = (await adb().table("domains").select("*").eq("id", id).execute()).data
 
     if not responce:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="domain not found"
         )
-    else:
-        domain = responce[0]
+    if responce[0]["owner_id"] != user.id:
+        raise HTTPException(403, "Not authorized")
+
+    domain = (
+        await adb().table("domains").update({"is_active": False}).eq("id", id).execute()
+    ).data[0]
+    invalidate_domain(domain["domain"])
+    response_cache.bump(DOMAINS_SCOPE)
 
     return domain
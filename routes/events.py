@@ -1,32 +1,59 @@
 import datetime
+import logging
 from typing import List
-from fastapi import APIRouter, Depends, status, HTTPException, Query
-from database import db
-from models import Event, EventData, ApiKey
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Request,
+    Response,
+    status,
+    HTTPException,
+    Query,
+)
+from core.bodies import iter_lines, parse_beacon, parse_events, read_body
+from core.metrics import timed
+from core.ingest import (
+    BulkWriteFailed,
+    EventWriter,
+    IngestQueueFull,
+    bulk_import,
+    bulk_slots,
+    get_event_writer,
+)
+from core.serialization import TrustedJSONResponse
+from database import adb
+from models import DomainData, Event, EventData, ApiKey
 from utils import (
-    get_domain,
+    cached_tracking_key,
+    decode_cursor,
+    encode_cursor,
     require_domain_session,
     require_user_session,
-    verify_api_key,
+    resolve_tracking_key,
+    verify_tracking_key,
 )
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/events", tags=["Events"])
 
 
 @router.get("/", response_model=List[EventData])
-def get_events(
+async def get_events(
     user=Depends(require_user_session),
     user_id: int | None = None,
     domain_id: int | None = None,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: str | None = Query(None, description="X-Next-Cursor of the last page"),
 ):
     req_id = user_id or user.id
-    event_query = db().table("events").select("*")
+    event_query = adb().table("events").select("*")
 
     if domain_id:
         domain = (
-            db()
+            await adb()
             .table("domains")
             .select("id, owner_id")
             .eq("id", domain_id)
@@ -48,57 +75,238 @@ def get_events(
 
         event_query = event_query.eq("user_id", req_id)
 
-    events = (
-        event_query.order("created_at", desc=True)
-        .limit(limit)
-        .offset(offset)
-        .execute()
-        .data
-    )
+    event_query = event_query.order("created_at", desc=True).order("id", desc=True)
+
+    if cursor:
+        if offset:
+            raise HTTPException(400, "use either cursor or offset")
+        try:
+            created_at, id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "invalid cursor")
+        event_query = event_query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt.{id})'
+        )
+    else:
+        # Legacy offset paging, cost grows with the offset
+        event_query = event_query.offset(offset)
+
+    events = (await event_query.limit(limit).execute()).data or []
+
+    headers = {}
+    if len(events) == limit:
+        last = events[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
 
-    return events or []
+    return TrustedJSONResponse(events, EventData, headers=headers)
 
 
-@router.post("/track", status_code=status.HTTP_201_CREATED)
-def track_event(events: List[Event], api_key: ApiKey = Depends(verify_api_key)):
+def check_tracking_key(key: tuple[ApiKey, DomainData]) -> tuple[ApiKey, DomainData]:
+    api_key, owner = key
 
     if api_key["revoked"]:
         raise HTTPException(403, "revoked API key please renew")
 
-    owner = get_domain(api_key["domain"])
     if not owner:
         raise HTTPException(404, "Domain not found")
-    if not owner["is_active"]:
+    if not owner.is_active:
         raise HTTPException(403, "Domain is not active")
 
-    if len(events) < 1:
-        raise HTTPException(400, "no events found to track")
-    if len(events) > 50:
-        raise HTTPException(400, "events exeded")
+    return key
+
+
+def active_tracking_key(
+    key: tuple[ApiKey, DomainData] = Depends(verify_tracking_key),
+) -> tuple[ApiKey, DomainData]:
+    return check_tracking_key(key)
 
+
+def event_rows(events: List[Event], key: tuple[ApiKey, DomainData]) -> List[dict]:
+    api_key, owner = key
     rows = []
     for event in events:
-        new_event = event.model_dump()
+        new_event = event.model_dump(mode="json")
         new_event.update(
             {
                 "domain_id": api_key["domain_id"],
-                "user_id": owner["owner_id"],
+                "user_id": owner.owner_id,
             }
         )
         rows.append(new_event)
+    return rows
+
+
+def queue_full():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="ingestion queue is full, retry later",
+        headers={"Retry-After": "1"},
+    )
+
+
+@router.post(
+    "/track",
+    status_code=status.HTTP_202_ACCEPTED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": Event.model_json_schema()}
+                }
+            },
+        }
+    },
+)
+async def track_event(
+    request: Request,
+    key: tuple[ApiKey, DomainData] = Depends(active_tracking_key),
+    writer: EventWriter = Depends(get_event_writer),
+):
+    """Accepts a list of events or a `{"shared", "events"}` envelope,
+    optionally gzip or brotli compressed (`Content-Encoding`)"""
+    api_key, owner = key
+
+    with timed("body"):
+        body = await read_body(request)
+    with timed("validate"):
+        events = parse_events(body)
+    check_batch_size(events)
 
-    db().table("events").insert(rows).execute()
+    try:
+        with timed("enqueue"):
+            queued = writer.enqueue(event_rows(events, key))
+    except IngestQueueFull:
+        raise queue_full()
 
-    return {"status": "ok", "inserted": len(events)}
+    return {"status": "accepted", "queued": queued}
+
+
+def check_batch_size(events: List[Event]):
+    if len(events) < 1:
+        raise HTTPException(400, "no events found to track")
+    if len(events) > 50:
+        raise HTTPException(400, "events exeded")
+
+
+async def enqueue_beacon(key: str, events: List[Event], writer: EventWriter):
+    """Resolve an uncached beacon key after the response went out"""
+    try:
+        resolved = check_tracking_key(await resolve_tracking_key(key))
+        writer.enqueue(event_rows(events, resolved))
+    except (HTTPException, IngestQueueFull) as e:
+        logger.info("dropped beacon of %d events: %r", len(events), e)
+
+
+@router.post(
+    "/beacon",
+    status_code=status.HTTP_204_NO_CONTENT,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "text/plain": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "key": {"type": "string"},
+                            "shared": {"type": "object"},
+                            "events": {"type": "array", "items": {"type": "object"}},
+                        },
+                    }
+                }
+            },
+        }
+    },
+)
+async def track_beacon(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    key: str | None = Query(None, description="API key, if not sent in the body"),
+    writer: EventWriter = Depends(get_event_writer),
+):
+    """`navigator.sendBeacon` target: the same batches as `/track`, sent as
+    `text/plain` with the API key in the envelope (`"key"`) or query string.
+    Beacons can't set Content-Encoding, so gzipped bodies are recognized by
+    their magic bytes.
+
+    Events are queued before any database work: a key that isn't cached
+    yet is resolved after the empty response, and the batch is dropped
+    then if the key turns out to be invalid.
+    """
+    body_key, events = parse_beacon(await read_body(request, sniff_gzip=True))
+    key = body_key or key
+    if not key:
+        raise HTTPException(401, "missing API key")
+    check_batch_size(events)
+
+    cached = cached_tracking_key(key)
+    if cached is None:
+        background_tasks.add_task(enqueue_beacon, key, events, writer)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    resolved = check_tracking_key(cached)
+    try:
+        writer.enqueue(event_rows(events, resolved))
+    except IngestQueueFull:
+        raise queue_full()
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post(
+    "/bulk",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/x-ndjson": {"schema": Event.model_json_schema()}},
+        }
+    },
+)
+async def bulk_track_events(
+    request: Request,
+    key: tuple[ApiKey, DomainData] = Depends(active_tracking_key),
+    writer: EventWriter = Depends(get_event_writer),
+):
+    """Imports newline-delimited events (one JSON object per line, optionally
+    gzip or brotli compressed) of any size, for backfills and replays.
+
+    Invalid lines are skipped and reported by line number. If an insert
+    fails the response is 503 with `resume_from_line`, every line before
+    it has been stored.
+    """
+    api_key, owner = key
+
+    if bulk_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="too many bulk imports running, retry later",
+            headers={"Retry-After": "30"},
+        )
+
+    extra = {"domain_id": api_key["domain_id"], "user_id": owner.owner_id}
+
+    async with bulk_slots:
+        try:
+            report = await bulk_import(iter_lines(request), extra, writer)
+        except BulkWriteFailed as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={**e.report, "resume_from_line": e.line},
+                headers={"Retry-After": "30"},
+            )
+
+    return report
 
 
 @router.get(
     "/event/latest", status_code=status.HTTP_202_ACCEPTED, response_model=EventData
 )
-def get_last_event():
+async def get_last_event():
 
     responce = (
-        db()
+        await adb()
         .table("events")
         .select("*")
         .limit(1)
@@ -118,10 +326,10 @@ def get_last_event():
 
 
 @router.get("/event/{id}", response_model=EventData)
-def get_event(id: int, user=Depends(require_user_session)):
+async def get_event(id: int, user=Depends(require_user_session)):
 
     responce = (
-        db().table("events").select("*").eq("id", id).limit(1).single().execute()
+        await adb().table("events").select("*").eq("id", id).limit(1).single().execute()
     ).data
 
     if not responce:
@@ -135,10 +343,15 @@ def get_event(id: int, user=Depends(require_user_session)):
 
 
 @router.delete("/event/latest", status_code=status.HTTP_204_NO_CONTENT)
-def delete_event(user=Depends(require_user_session)):
+async def delete_event(user=Depends(require_user_session)):
 
     id = (
-        db().table("events").select("id").order("id", desc=True).limit(1).execute()
+        await adb()
+        .table("events")
+        .select("id")
+        .order("id", desc=True)
+        .limit(1)
+        .execute()
     ).data[0]["id"]
 
     if not id:
@@ -146,13 +359,13 @@ def delete_event(user=Depends(require_user_session)):
             status_code=status.HTTP_404_NOT_FOUND, detail="not events found"
         )
     else:
-        responce = (db().table("events").delete().eq("id", id).execute()).data
+        responce = (await adb().table("events").delete().eq("id", id).execute()).data
 
 
 @router.delete("/event/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_event(id: int, user=Depends(require_user_session)):
+async def delete_event(id: int, user=Depends(require_user_session)):
 
-    responce = (db().table("events").delete().eq("id", id).execute()).data
+    responce = (await adb().table("events").delete().eq("id", id).execute()).data
 
     if not responce:
         raise HTTPException(
@@ -1,6 +1,7 @@
 from typing import List
 from fastapi import APIRouter, Depends, Query, status, HTTPException
-from database import db
+from core.serialization import TrustedJSONResponse
+from database import adb
 from models import UserData
 from utils import require_user_session
 
@@ -8,10 +9,10 @@ router = APIRouter(prefix="/users", tags=["Users"])
 
 
 @router.get("/", response_model=List[UserData])
-def get_user(limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0)):
+async def get_user(limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0)):
 
     responce = (
-        db().table("users").select("*").limit(limit).offset(offset).execute()
+        await adb().table("users").select("*").limit(limit).offset(offset).execute()
     ).data
 
     if not responce:
@@ -21,13 +22,13 @@ def get_user(limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0))
     else:
         users = responce
 
-    return users
+    return TrustedJSONResponse(users, UserData)
 
 
 @router.get("/user/{id}", response_model=UserData)
-def get_user(id: int, user=Depends(require_user_session)):
+async def get_user(id: int, user=Depends(require_user_session)):
 
-    responce = (db().table("users").select("*").eq("id", id).execute()).data
+    responce = (await adb().table("users").select("*").eq("id", id).execute()).data
 
     if not responce:
         raise HTTPException(
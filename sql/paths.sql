@@ -0,0 +1,88 @@
+-- Daily page-transition counts maintained by core/paths.py. Pseudo pages
+-- '(entrance)' and '(exit)' mark where sessions start and end.
+
+create table if not exists path_edges (
+    domain_id bigint not null references domains (id) on delete cascade,
+    day date not null,
+    from_path text not null,
+    to_path text not null,
+    count bigint not null default 0,
+    primary key (domain_id, from_path, day, to_path)
+);
+
+-- For the reverse direction, "which pages lead to X"
+create index if not exists path_edges_to_idx on path_edges (domain_id, to_path, day);
+
+-- Adds counts instead of overwriting them, so every worker can flush
+create or replace function increment_path_edges(rows jsonb)
+returns void
+language sql
+as $$
+    insert into path_edges (domain_id, day, from_path, to_path, count)
+    select
+        (r ->> 'domain_id')::bigint,
+        (r ->> 'day')::date,
+        r ->> 'from_path',
+        r ->> 'to_path',
+        (r ->> 'count')::bigint
+    from jsonb_array_elements(rows) as r
+    on conflict (domain_id, from_path, day, to_path)
+    do update set count = path_edges.count + excluded.count;
+$$;
+
+-- Top `p_top` pages following `p_path` (or preceding it when p_forward is
+-- false), each row also carrying the total over all neighbours
+create or replace function path_neighbors(
+    p_domain_id bigint,
+    p_start date,
+    p_end date,
+    p_path text,
+    p_forward boolean default true,
+    p_top int default 10
+)
+returns table (path text, count bigint, total bigint)
+language sql
+stable
+as $$
+    select n.path, n.count, n.total
+    from (
+        select case when p_forward then e.to_path else e.from_path end as path,
+               sum(e.count)::bigint as count,
+               sum(sum(e.count)) over ()::bigint as total
+        from path_edges e
+        where e.domain_id = p_domain_id
+          and e.day between p_start and p_end
+          and (case when p_forward then e.from_path else e.to_path end) = p_path
+        group by 1
+        having sum(e.count) > 0
+    ) n
+    order by n.count desc, n.path
+    limit p_top;
+$$;
+
+-- Count of each funnel step: arrivals on the first page, then transitions
+-- from each step's page straight to the next one
+create or replace function path_funnel(
+    p_domain_id bigint,
+    p_start date,
+    p_end date,
+    p_steps text[]
+)
+returns table (step int, path text, count bigint)
+language sql
+stable
+as $$
+    select s.step, p_steps[s.step], coalesce(sum(e.count), 0)::bigint
+    from generate_subscripts(p_steps, 1) as s(step)
+    left join path_edges e
+      on e.domain_id = p_domain_id
+     and e.day between p_start and p_end
+     and case
+             when s.step > 1 then
+                 e.from_path = p_steps[s.step - 1] and e.to_path = p_steps[s.step]
+             when p_steps[1] = '(entrance)' then e.from_path = '(entrance)'
+             else e.to_path = p_steps[1]
+         end
+    group by s.step
+    order by s.step;
+$$;
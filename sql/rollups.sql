@@ -0,0 +1,114 @@
+-- Hourly rollups maintained by core/rollups.py
+
+create table if not exists rollups (
+    domain_id bigint not null references domains (id) on delete cascade,
+    bucket timestamptz not null,
+    dimension text not null,
+    key text not null,
+    count bigint not null default 0,
+    primary key (domain_id, dimension, bucket, key)
+);
+
+-- Adds counts instead of overwriting them, so every worker can flush
+create or replace function increment_rollups(rows jsonb)
+returns void
+language sql
+as $$
+    insert into rollups (domain_id, bucket, dimension, key, count)
+    select
+        (r ->> 'domain_id')::bigint,
+        (r ->> 'bucket')::timestamptz,
+        r ->> 'dimension',
+        r ->> 'key',
+        (r ->> 'count')::bigint
+    from jsonb_array_elements(rows) as r
+    on conflict (domain_id, dimension, bucket, key)
+    do update set count = rollups.count + excluded.count;
+$$;
+
+-- Top `p_top` keys per dimension plus one 'total' row per dimension
+create or replace function rollup_summary(
+    p_domain_id bigint,
+    p_start timestamptz,
+    p_end timestamptz,
+    p_top int default 10
+)
+returns table (dimension text, key text, count bigint)
+language sql
+stable
+as $$
+    with merged as (
+        select r.dimension, r.key, sum(r.count)::bigint as count
+        from rollups r
+        where r.domain_id = p_domain_id
+          and r.bucket >= date_trunc('hour', p_start)
+          and r.bucket <= p_end
+        group by r.dimension, r.key
+    )
+    select m.dimension, m.key, m.count
+    from (
+        select merged.*,
+               row_number() over (partition by merged.dimension order by merged.count desc) as rank
+        from merged
+    ) m
+    where m.rank <= p_top
+    union all
+    select 'total', merged.dimension, sum(merged.count)::bigint
+    from merged
+    group by merged.dimension;
+$$;
+
+-- Event and session counts per minute, hour or day for /analytics/timeseries.
+-- Hour and day charts read the hourly 'events' rollups; minute charts cover
+-- short ranges and count the events themselves. Sessions are counted by
+-- their start. Buckets are UTC and only non-empty ones are returned.
+create or replace function rollup_timeseries(
+    p_domain_id bigint,
+    p_start timestamptz,
+    p_end timestamptz,
+    p_granularity text,
+    p_event_type text default null
+)
+returns table (bucket timestamptz, events bigint, sessions bigint)
+language sql
+stable
+as $$
+    with event_counts as (
+        select date_trunc(p_granularity, r.bucket) as bucket,
+               sum(r.count)::bigint as events
+        from rollups r
+        where p_granularity <> 'minute'
+          and r.domain_id = p_domain_id
+          and r.dimension = 'events'
+          and (p_event_type is null or r.key = p_event_type)
+          and r.bucket >= date_trunc('hour', p_start)
+          and r.bucket <= p_end
+        group by 1
+        union all
+        select date_trunc('minute', e.timestamp), count(*)::bigint
+        from events e
+        where p_granularity = 'minute'
+          and e.domain_id = p_domain_id
+          and (p_event_type is null or e.event_type = p_event_type)
+          and e.timestamp >= p_start
+          and e.timestamp <= p_end
+        group by 1
+    ), session_counts as (
+        select date_trunc(p_granularity, s.start) as bucket,
+               count(*)::bigint as sessions
+        from sessions s
+        where s.domain_id = p_domain_id
+          and s.start >= p_start
+          and s.start <= p_end
+        group by 1
+    )
+    select coalesce(e.bucket, s.bucket) as bucket,
+           coalesce(e.events, 0) as events,
+           coalesce(s.sessions, 0) as sessions
+    from event_counts e
+    full join session_counts s on s.bucket = e.bucket
+    order by 1;
+$$;
+
+create index if not exists events_domain_timestamp_idx on events (domain_id, timestamp);
+create index if not exists sessions_domain_start_idx on sessions (domain_id, start);
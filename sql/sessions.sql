@@ -0,0 +1,49 @@
+-- Sessions maintained by core/sessions.py
+
+-- The conflict target of the upserts below and of /analytics/sessions
+create unique index if not exists sessions_session_id_key on sessions (session_id);
+
+-- The keyset order of the sessions rebuild (utils.scan_events), which
+-- filters on the domain name rather than domain_id
+create index if not exists events_domain_session_idx
+    on events (domain, session_id, timestamp, id);
+
+-- Merges partial sessions: each worker only sees the events it received,
+-- and sends the events counted since its last flush. Start and end widen,
+-- counts add up and the entry/exit pages follow the earliest/latest part.
+create or replace function merge_sessions(rows jsonb)
+returns void
+language sql
+as $$
+    insert into sessions (
+        session_id, domain_id, user_id, "start", "end", duration, event_count,
+        device, os, browser, entry_path, exit_path
+    )
+    select
+        r.session_id, r.domain_id, r.user_id, r."start", r."end", r.duration,
+        r.event_count, r.device, r.os, r.browser, r.entry_path, r.exit_path
+    from jsonb_populate_recordset(null::sessions, rows) as r
+    on conflict (session_id) do update set
+        "start" = least(sessions."start", excluded."start"),
+        "end" = greatest(sessions."end", excluded."end"),
+        duration = extract(epoch from
+            greatest(sessions."end", excluded."end")
+            - least(sessions."start", excluded."start")),
+        event_count = sessions.event_count + excluded.event_count,
+        user_id = coalesce(sessions.user_id, excluded.user_id),
+        device = coalesce(sessions.device, excluded.device),
+        os = coalesce(sessions.os, excluded.os),
+        browser = coalesce(sessions.browser, excluded.browser),
+        entry_path = case
+            when excluded.entry_path is not null
+                 and (sessions.entry_path is null or excluded."start" < sessions."start")
+            then excluded.entry_path
+            else sessions.entry_path
+        end,
+        exit_path = case
+            when excluded.exit_path is not null
+                 and (sessions.exit_path is null or excluded."end" >= sessions."end")
+            then excluded.exit_path
+            else sessions.exit_path
+        end;
+$$;
@@ -0,0 +1,35 @@
+-- Refresh token rotation used by /auth/refresh
+
+-- Revokes `p_old_hash` and stores `p_new_hash` for the same user in one
+-- transaction. Returns the user's id and email (for the new access token's
+-- claims), or no row if the old token was unknown, already revoked or
+-- expired.
+
+create or replace function rotate_refresh_token(
+    p_old_hash text,
+    p_new_hash text,
+    p_expires_at timestamptz
+)
+returns table (user_id bigint, email text)
+language sql
+as $$
+    with revoked as (
+        update tokens
+        set revoked = true
+        where token_hash = p_old_hash
+          and not revoked
+          and expires_at > now()
+        returning user_id
+    ), issued as (
+        insert into tokens (user_id, token_hash, expires_at, revoked)
+        select user_id, p_new_hash, p_expires_at, false
+        from revoked
+        returning user_id
+    )
+    select u.id, u.email
+    from issued
+    join users u on u.id = issued.user_id;
+$$;
+
+create index if not exists tokens_token_hash_idx on tokens (token_hash);
+create index if not exists tokens_user_id_idx on tokens (user_id) where not revoked;
@@ -0,0 +1,80 @@
+-- HyperLogLog sketches of session ids maintained by core/uniques.py, one
+-- per domain, hour, dimension ('visitors' or 'pages') and key (pathname,
+-- '' for visitors). A sketch is one precision byte followed by one byte per
+-- register, see core/hll.py.
+
+create table if not exists sketches (
+    domain_id bigint not null references domains (id) on delete cascade,
+    bucket timestamptz not null,
+    dimension text not null,
+    key text not null,
+    sketch bytea not null,
+    primary key (domain_id, dimension, key, bucket)
+);
+
+-- Register-wise maximum of two sketches of the same precision
+create or replace function hll_union(a bytea, b bytea)
+returns bytea
+language sql
+immutable
+as $$
+    select case
+        when a is null then b
+        when b is null then a
+        else (
+            select decode(
+                string_agg(
+                    lpad(to_hex(greatest(get_byte(a, i), get_byte(b, i))), 2, '0'),
+                    '' order by i
+                ),
+                'hex'
+            )
+            from generate_series(0, length(a) - 1) as i
+        )
+    end;
+$$;
+
+-- Merges instead of overwriting, so every worker can flush. Sketches travel
+-- base64 encoded.
+create or replace function merge_sketches(rows jsonb)
+returns void
+language sql
+as $$
+    insert into sketches (domain_id, bucket, dimension, key, sketch)
+    select
+        (r ->> 'domain_id')::bigint,
+        (r ->> 'bucket')::timestamptz,
+        r ->> 'dimension',
+        r ->> 'key',
+        decode(r ->> 'sketch', 'base64')
+    from jsonb_array_elements(rows) as r
+    on conflict (domain_id, dimension, key, bucket)
+    do update set sketch = hll_union(sketches.sketch, excluded.sketch);
+$$;
+
+-- The union of the hourly sketches between p_start and p_end, base64
+-- encoded, null when there are none. Only the merged sketch leaves the
+-- database.
+create or replace function union_sketches(
+    p_domain_id bigint,
+    p_start timestamptz,
+    p_end timestamptz,
+    p_dimension text,
+    p_key text
+)
+returns text
+language sql
+stable
+as $$
+    select encode(decode(string_agg(lpad(to_hex(r.register), 2, '0'), '' order by r.i), 'hex'), 'base64')
+    from (
+        select i, max(get_byte(s.sketch, i)) as register
+        from sketches s, generate_series(0, length(s.sketch) - 1) as i
+        where s.domain_id = p_domain_id
+          and s.dimension = p_dimension
+          and s.key = p_key
+          and s.bucket >= date_trunc('hour', p_start)
+          and s.bucket <= p_end
+        group by i
+    ) r;
+$$;
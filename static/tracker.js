@@ -9,6 +9,7 @@
   console.log("Tracker ready and watching for events");
 
   const API_URL = "https://api-cloudboard.vercel.app/events/track"; // track endpoint de la API
+  const BEACON_URL = "https://api-cloudboard.vercel.app/events/beacon";
   const DOMAIN = window.location.hostname;
   const PATHNAME = window.location.pathname;
   const REFERRER = document.referrer || null;
@@ -39,27 +40,65 @@
     sessionStorage.setItem("tracker_session", sessionId);
   }
 
-  async function flushEvents(useBeacon = false) {
-    if (!sessionEvents.length) return;
+  // Campos iguales en todo el batch: se envían una sola vez
+  const SHARED = {
+    domain: DOMAIN,
+    pathname: PATHNAME,
+    referrer: REFERRER,
+    user_agent: USER_AGENT,
+    screen_width: SCREEN_WIDTH,
+    screen_height: SCREEN_HEIGHT,
+    session_id: sessionId,
+  };
+
+  function toEnvelope(batch) {
+    return {
+      shared: SHARED,
+      events: batch.map((event) => {
+        const delta = {};
+        for (const key in event) {
+          if (event[key] !== SHARED[key]) delta[key] = event[key];
+        }
+        return delta;
+      }),
+    };
+  }
 
-    const batch = sessionEvents.splice(0, sessionEvents.length);
+  function canGzip() {
+    return typeof CompressionStream !== "undefined";
+  }
 
-    if (useBeacon && navigator.sendBeacon) {
-      const blob = new Blob([JSON.stringify(batch)], {
-        type: "application/json",
-      });
-      navigator.sendBeacon(API_URL, blob);
-      return;
+  async function gzip(text) {
+    const stream = new Blob([text])
+      .stream()
+      .pipeThrough(new CompressionStream("gzip"));
+    return new Response(stream).blob();
+  }
+
+  // gzip con CompressionStream si el navegador lo soporta
+  async function encodeBatch(batch) {
+    const json = JSON.stringify(toEnvelope(batch));
+    if (!canGzip()) {
+      return { body: json, encoding: null };
     }
+    return { body: await gzip(json), encoding: "gzip" };
+  }
 
+  // Respaldo si el navegador no acepta el beacon (sin soporte o cola llena)
+  async function postBatch(batch) {
     try {
+      const { body, encoding } = await encodeBatch(batch);
+      const headers = {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${ApiKey}`,
+      };
+      if (encoding) headers["Content-Encoding"] = encoding;
+
       const res = await fetch(API_URL, {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          Authorization: `Bearer ${ApiKey}`,
-        },
-        body: JSON.stringify(batch),
+        headers,
+        body,
+        keepalive: true,
       });
 
       if (!res.ok) console.error("Tracking error:", await res.text());
@@ -68,18 +107,45 @@
     }
   }
 
+  function sendBeacon(batch, body) {
+    const blob = new Blob([body], { type: "text/plain" });
+    if (!navigator.sendBeacon || !navigator.sendBeacon(BEACON_URL, blob)) {
+      postBatch(batch);
+    }
+  }
+
+  // Todos los envíos van por beacon: no bloquea la página y sobrevive al cierre.
+  // text/plain evita el preflight CORS y la API key viaja en el cuerpo.
+  // El beacon no admite Content-Encoding: el cuerpo va en gzip y la API lo
+  // reconoce por sus bytes mágicos. Al salir de la página (final) se envía
+  // sin comprimir, porque la compresión es asíncrona y podría no terminar.
+  function flushEvents(final = false) {
+    if (!sessionEvents.length) return;
+
+    const batch = sessionEvents.splice(0, sessionEvents.length);
+    const json = JSON.stringify({ key: ApiKey, ...toEnvelope(batch) });
+
+    if (final || !canGzip()) {
+      sendBeacon(batch, json);
+      return;
+    }
+
+    gzip(json).then(
+      (body) => sendBeacon(batch, body),
+      () => sendBeacon(batch, json)
+    );
+  }
+
   async function queueEvent(payload) {
     sessionEvents.push(payload);
 
     if (sessionEvents.length >= MAX_BATCH_SIZE) {
       flushEvents();
     }
-
-    setInterval(() => {
-      flushEvents;
-    }, FLUSH_INTERVAL);
   }
 
+  setInterval(() => flushEvents(), FLUSH_INTERVAL);
+
   async function sendEvent(event, element, data = {}, useBeacon = false) {
     const payload = {
       domain: DOMAIN,
@@ -92,6 +158,7 @@
       event_type: event,
       element: element,
       time_spent: (performance.now() - PAGE_START) / 1000,
+      timestamp: new Date().toISOString(),
       ...data,
     };
 
@@ -120,24 +187,18 @@
   // Evento: salida o cierre
   window.addEventListener("beforeunload", () => {
     sendEvent("exit", PATHNAME);
-    flushEvents(true); // beacon
+    flushEvents(true);
   });
 
   document.addEventListener("visibilitychange", () => {
     if (document.visibilityState === "hidden") {
-      sendEvent({
-        event_type: "page_hidden",
-        pathname: PATHNAME,
-      });
+      sendEvent("page_hidden", PATHNAME);
 
-      flushEvents(true); // beacon
+      flushEvents(true);
     }
 
     if (document.visibilityState === "visible") {
-      sendEvent({
-        event_type: "page_visible",
-        pathname: PATHNAME,
-      });
+      sendEvent("page_visible", PATHNAME);
     }
   });
 })();
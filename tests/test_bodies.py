@@ -0,0 +1,113 @@
+import asyncio
+import gzip
+
+import brotli
+import orjson
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from core.bodies import (
+    MAX_BODY_BYTES,
+    MAX_LINE_BYTES,
+    iter_lines,
+    parse_beacon,
+    parse_events,
+    read_body,
+)
+
+
+def request(body: bytes, encoding: str, chunk: int = 16 * 1024) -> Request:
+    chunks = [body[i : i + chunk] for i in range(0, len(body), chunk)] or [b""]
+
+    async def receive():
+        piece = chunks.pop(0)
+        return {"type": "http.request", "body": piece, "more_body": bool(chunks)}
+
+    headers = [(b"content-encoding", encoding.encode())]
+    return Request({"type": "http", "method": "POST", "headers": headers}, receive)
+
+
+def read_lines(body: bytes, encoding: str) -> list:
+    async def collect():
+        return [line async for line in iter_lines(request(body, encoding))]
+
+    return asyncio.run(collect())
+
+
+def ndjson(lines: int) -> bytes:
+    # a few hundred bytes a line, highly compressible so one compressed chunk
+    # expands to more than a decode step
+    return b"\n".join(
+        orjson.dumps({"event_type": "page_load", "pathname": f"/{i * 7919:x}" * 60})
+        for i in range(lines)
+    )
+
+
+@pytest.mark.parametrize(
+    "encoding, compress",
+    [
+        ("br", lambda body: brotli.compress(body, quality=11)),
+        ("gzip", gzip.compress),
+    ],
+)
+def test_large_compressed_body_is_fully_decoded(encoding, compress):
+    body = ndjson(500)
+    assert len(body) > 200 * 1024 and len(body) // 500 < MAX_LINE_BYTES
+
+    lines = read_lines(compress(body), encoding)
+
+    assert len(lines) == 500
+    assert b"\n".join(lines) == body
+
+
+def test_brotli_body_sent_in_one_chunk():
+    body = ndjson(500)
+    lines = read_lines(brotli.compress(body), "br")
+    assert len(lines) == 500
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"events": 5},
+        {"events": {"event_type": "click"}},
+        {"shared": 5, "events": []},
+        {"shared": ["x"], "events": [{}]},
+    ],
+)
+def test_malformed_envelope_is_rejected(payload):
+    with pytest.raises(HTTPException) as e:
+        parse_events(orjson.dumps(payload))
+    assert e.value.status_code == 422
+
+    with pytest.raises(HTTPException) as e:
+        parse_beacon(orjson.dumps({"key": "k", **payload}))
+    assert e.value.status_code == 422
+
+
+def beacon() -> bytes:
+    return orjson.dumps(
+        {"key": "k", "events": [{"event_type": "click", "pathname": "/"}] * 20}
+    )
+
+
+@pytest.mark.parametrize("chunk", [1, 16 * 1024])
+def test_gzipped_beacon_is_sniffed(chunk):
+    body = beacon()
+    decoded = asyncio.run(
+        read_body(request(gzip.compress(body), "", chunk), sniff_gzip=True)
+    )
+    assert decoded == body
+
+
+def test_plain_beacon_is_untouched_by_sniffing():
+    body = beacon()
+    assert asyncio.run(read_body(request(body, "", 1), sniff_gzip=True)) == body
+
+
+def test_sniffed_gzip_is_size_limited():
+    bomb = gzip.compress(b" " * (MAX_BODY_BYTES + 1))
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_body(request(bomb, ""), sniff_gzip=True))
+    assert e.value.status_code == 413
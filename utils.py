@@ -1,4 +1,6 @@
-from user_agents import parse
+import asyncio
+import base64
+import json
 from itertools import groupby
 from fastapi import Depends, HTTPException, status
 from fastapi.security import (
@@ -7,19 +9,40 @@ from fastapi.security import (
     HTTPAuthorizationCredentials,
 )
 from datetime import datetime, timedelta, timezone
-import jwt
 import secrets
-from typing import Annotated, List, Optional
-from jwt.exceptions import InvalidTokenError
+import time
+from typing import Annotated, AsyncIterable, AsyncIterator, List, Optional
 from models import DomainData, Event, RefreshToken, Session, User, UserData
-from database import db
+from database import adb
 from config import config
-from pwdlib import PasswordHash
 from hashlib import sha256
+from core.agents import agent_parser
+from core.cache import TTLCache
+from core.hashing import HashingBusy, get_password_hash, password_hasher
+from core.metrics import timed
 
 security = HTTPBearer(auto_error=True)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
-password_hash = PasswordHash.recommended()
+
+# Hot path lookups for /events/track, keyed by key_hash and domain name
+api_key_cache = TTLCache(maxsize=4096, ttl=300, name="api_keys")
+domain_cache = TTLCache(maxsize=4096, ttl=300, name="domains")
+# Decoded access tokens, keyed by token hash and expiring with the token
+access_token_cache = TTLCache(
+    maxsize=10_000, ttl=config.ACCESS_TOKEN_EXPIRE_MINUTES * 60, name="access_tokens"
+)
+# user id -> time of logout, access tokens issued before it are rejected
+revoked_users = TTLCache(
+    maxsize=10_000, ttl=config.ACCESS_TOKEN_EXPIRE_MINUTES * 60, name="revoked_users"
+)
+
+
+def _jwt():
+    # PyJWT loads cryptography, keep it off the cold-start path until a
+    # token is actually handled
+    import jwt
+
+    return jwt
 
 
 def refresh_expire_time():
@@ -33,6 +56,29 @@ def parse_db_datetime(value: str) -> datetime:
     return dt
 
 
+def quote_filter_value(value) -> str:
+    """Double-quote a value for a PostgREST logical filter (`or=(...)`),
+    escaping backslashes and quotes so it can't close the literal"""
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def encode_cursor(created_at: str, id: int) -> str:
+    """Opaque keyset cursor for paging on (created_at, id)"""
+    raw = json.dumps([created_at, id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        parse_db_datetime(created_at)
+        return created_at, int(id)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid cursor {cursor!r}")
+
+
 def generate_api_key(domain: str):
     raw = secrets.token_urlsafe(32)
     return f"cKey_{domain}_{raw}"
@@ -44,7 +90,7 @@ def hash_api_key(key: str):
 
 def hash_password(password: str) -> str:
     """Hash password plano"""
-    return password_hash.hash(password)
+    return get_password_hash().hash(password)
 
 
 def hash_token(token: str) -> str:
@@ -53,32 +99,106 @@ def hash_token(token: str) -> str:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plaintext password against a hashed password."""
-    return password_hash.verify(plain_password, hashed_password)
+    return get_password_hash().verify(plain_password, hashed_password)
 
 
-def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def hashing_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="too many concurrent logins, retry later",
+        headers={"Retry-After": "1"},
+    )
 
-    api_key = credentials.credentials
-    key_hash = hash_api_key(api_key)
 
-    record = (
-        db()
-        .table("api_keys")
-        .select("*")
-        .eq("key_hash", key_hash)
-        .eq("revoked", False)
-        .execute()
-        .data
+async def hash_password_async(password: str) -> str:
+    """`hash_password` in the hashing pool, for request handlers"""
+    try:
+        return await password_hasher.hash(password)
+    except HashingBusy:
+        raise hashing_busy()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """`verify_password` in the hashing pool, for request handlers"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashingBusy:
+        raise hashing_busy()
+
+
+def api_key_domain(key: str) -> str:
+    """Domain embedded in a key made by `generate_api_key`"""
+    # token_urlsafe(32) is always 43 characters, preceded by "_"
+    return key[len("cKey_") : -44]
+
+
+async def get_api_key_record(key_hash: str):
+
+    cached = api_key_cache.get(key_hash)
+    if cached is not None:
+        return cached
+
+    with timed("api_key_lookup"):
+        record = (
+            await adb()
+            .table("api_keys")
+            .select("*")
+            .eq("key_hash", key_hash)
+            .eq("revoked", False)
+            .execute()
+        ).data
+
+    if not record:
+        return None
+
+    api_key_cache.set(key_hash, record[0])
+    return record[0]
+
+
+async def verify_tracking_key(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    return await resolve_tracking_key(credentials.credentials)
+
+
+def cached_tracking_key(api_key: str):
+    """Key record and domain if both are cached, without any database call"""
+
+    record = api_key_cache.get(hash_api_key(api_key))
+    if record is None:
+        return None
+
+    domain = domain_cache.get(record["domain"])
+    if domain is None:
+        return None
+
+    return record, domain
+
+
+async def resolve_tracking_key(api_key: str):
+    """Resolve an API key and its domain with both lookups in flight at once"""
+
+    record, domain = await asyncio.gather(
+        get_api_key_record(hash_api_key(api_key)),
+        get_domain(api_key_domain(api_key)),
     )
 
     if not record:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
-    return record[0]
+    if not domain or domain.domain != record["domain"]:
+        domain = await get_domain(record["domain"])
+
+    return record, domain
+
+
+def invalidate_api_keys(domain: str):
+    """Forget every cached key issued for `domain`"""
+    return api_key_cache.invalidate_where(lambda _, record: record["domain"] == domain)
 
 
-def store_refresh_token_db(token_data: dict):
-    result = db().table("tokens").insert(token_data).execute().data[0]["id"]
+async def store_refresh_token_db(token_data: dict):
+    result = (await adb().table("tokens").insert(token_data).execute()).data[0]["id"]
     if not result:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -87,68 +207,99 @@ def store_refresh_token_db(token_data: dict):
     return result
 
 
-def verify_refresh_token_db(token: str):
+async def revoke_user_token_db(user_id: int, token: str):
+    """Revoke one of the user's refresh tokens, by its value"""
+    await adb().table("tokens").update({"revoked": True}).eq("user_id", user_id).eq(
+        "token_hash", hash_token(token)
+    ).execute()
 
-    token_hash = hash_token(token)
 
-    record = (
-        db()
-        .table("tokens")
-        .select("*")
-        .eq("token_hash", token_hash)
-        .eq("revoked", False)
-        .execute()
-    ).data[0]
-    expire = parse_db_datetime(record["expires_at"])
-    if not record or expire < datetime.now(timezone.utc):
-        return None
+async def revoke_user_tokens_db(user_id: int):
+    """Revoke every live refresh token of a user in one statement"""
+    await adb().table("tokens").update({"revoked": True}).eq("user_id", user_id).eq(
+        "revoked", False
+    ).execute()
 
-    return record
 
+async def rotate_refresh_token_db(token: str, new_token: str) -> UserData | None:
+    """Revoke `token` and store `new_token` in a single round trip.
+
+    Returns the owner, or None when `token` is not valid.
+    """
+    rows = (
+        await adb()
+        .rpc(
+            "rotate_refresh_token",
+            {
+                "p_old_hash": hash_token(token),
+                "p_new_hash": hash_token(new_token),
+                "p_expires_at": refresh_expire_time().isoformat(),
+            },
+        )
+        .execute()
+    ).data
 
-def revoke_refresh_token_db(id: int):
-    db().table("tokens").update({"revoked": True}).eq("id", id).execute()
-    return
+    if not rows:
+        return None
+    return UserData(id=rows[0]["user_id"], email=rows[0]["email"])
 
 
-def get_user(email: str):
+async def get_user(email: str):
 
-    user = (db().table("users").select("*").eq("email", email).execute()).data[0]
+    user = (await adb().table("users").select("*").eq("email", email).execute()).data
 
     if not user:
         return None
 
-    return UserData(**user)
+    return UserData(**user[0])
 
 
-def get_domain(domain: str):
+async def get_domain(domain: str):
 
-    user = (db().table("domains").select("*").eq("domain", domain).execute()).data[0]
+    cached = domain_cache.get(domain)
+    if cached is not None:
+        return cached
 
-    if not user:
+    with timed("domain_lookup"):
+        record = (
+            await adb().table("domains").select("*").eq("domain", domain).execute()
+        ).data
+
+    if not record:
         return None
 
-    return DomainData(**user)
+    domain_data = DomainData(**record[0])
+    domain_cache.set(domain, domain_data)
+    return domain_data
+
+
+def invalidate_domain(domain: str):
+    domain_cache.pop(domain)
+    invalidate_api_keys(domain)
 
 
 def create_refresh_token():
     return secrets.token_urlsafe(64)
 
 
-def create_access_token(user_id: int):
+def create_access_token(user_id: int, email: str | None = None):
     expire = datetime.now(timezone.utc) + timedelta(
         minutes=config.ACCESS_TOKEN_EXPIRE_MINUTES
     )
 
     payload = {
         "sub": str(user_id),
+        "iat": time.time(),
         "exp": expire,
     }
+    if email:
+        payload["email"] = email
 
-    return jwt.encode(payload, config.SECRET_KEY, algorithm=config.ALGORITHM)
+    return _jwt().encode(payload, config.SECRET_KEY, algorithm=config.ALGORITHM)
 
 
 def verify_refresh_token(token: str):
+    jwt = _jwt()
     try:
         payload = jwt.decode(
             token,
@@ -164,11 +315,12 @@ def verify_refresh_token(token: str):
 
     except jwt.ExpiredSignatureError:
         return None
-    except InvalidTokenError:
+    except jwt.InvalidTokenError:
         return None
 
 
 def verify_access_token(token: str, credentials_exception):
+    jwt = _jwt()
     try:
         payload = jwt.decode(
             token,
@@ -185,7 +337,7 @@ def verify_access_token(token: str, credentials_exception):
     except jwt.ExpiredSignatureError:
         raise credentials_exception
 
-    except InvalidTokenError:
+    except jwt.InvalidTokenError:
         raise credentials_exception
 
 
@@ -200,25 +352,90 @@ def get_token_data(token: Annotated[str, Depends(oauth2_scheme)]):
     return verify_access_token(token, credentials_exception)
 
 
-def require_user_session(
-    token_id: int,
-):
+async def require_user_session(token: Annotated[str, Depends(oauth2_scheme)]):
 
-    user = db().table("users").select("*").eq("id", token_id).execute().data
-    if not user:
-        raise HTTPException(status_code=401)
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    token_hash = hash_token(token)
+    cached = access_token_cache.get(token_hash)
+
+    if cached is None:
+        jwt = _jwt()
+        try:
+            payload = jwt.decode(
+                token, config.SECRET_KEY, algorithms=[config.ALGORITHM]
+            )
+            user_id = int(payload["sub"])
+        except (jwt.InvalidTokenError, KeyError, ValueError):
+            raise credentials_exception
+
+        if payload.get("email"):
+            user = UserData(id=user_id, email=payload["email"])
+        else:
+            # Only access tokens issued before every token carried the
+            # email claim, until they expire
+            record = (
+                await adb()
+                .table("users")
+                .select("id, email")
+                .eq("id", user_id)
+                .execute()
+            ).data
+            if not record:
+                raise credentials_exception
+            user = UserData(**record[0])
+
+        cached = (user, payload.get("iat", 0))
+        access_token_cache.set(token_hash, cached, ttl=payload["exp"] - time.time())
+
+    user, issued_at = cached
+    revoked_at = revoked_users.get(user.id)
+    if revoked_at is not None and issued_at <= revoked_at:
+        raise credentials_exception
+
+    return user
 
-    return UserData(**user[0])
 
+def invalidate_user_tokens(user_id: int):
+    """Reject every access token issued to `user_id` so far"""
+    revoked_users.set(user_id, time.time())
+    access_token_cache.invalidate_where(lambda _, cached: cached[0].id == user_id)
 
-def require_domain_session(
+
+async def owned_domain(
+    domain: str, user: UserData = Depends(require_user_session)
+) -> DomainData:
+    """`?domain=` of a dashboard request, which must belong to the user.
+
+    Resolved before any cached response is served: cache keys don't
+    include the user.
+    """
+    record = await get_domain(domain)
+
+    if not record:
+        raise HTTPException(status_code=404, detail="domain not found")
+    if record.owner_id != user.id:
+        raise HTTPException(403, "Not authorized")
+
+    return record
+
+
+async def require_domain_session(
     token_data: int = Depends(get_token_data),
 ):
     print(token_data.domain)
 
     domain = (
-        db().table("domains").select("*").eq("domain", token_data.domain).execute().data
-    )
+        await adb()
+        .table("domains")
+        .select("*")
+        .eq("domain", token_data.domain)
+        .execute()
+    ).data
     if not domain:
         raise HTTPException(status_code=401)
 
@@ -229,14 +446,7 @@ def require_domain_session(
 
 
 def parse_agent(user_agent: str):
-    ua = parse(user_agent)
-
-    device = "mobile" if ua.is_mobile else "tablet" if ua.is_tablet else "desktop"
-
-    os = ua.os.family
-    browser = ua.browser.family
-
-    return {"device": device, "os": os, "browser": browser}
+    return agent_parser.parse(user_agent)
 
 
 def sort_events_by_session(events: List[Event]):
@@ -262,6 +472,87 @@ def get_paths(events: list[dict]):
     ]
 
 
+async def scan_events(
+    domain: str,
+    start: datetime,
+    end: datetime,
+    page_size: int = 1000,
+    columns: str = "*",
+) -> AsyncIterator[dict]:
+    """Stream a domain's events ordered by (session_id, timestamp, id).
+
+    Pages with a keyset cursor on the last row seen instead of offsets, so
+    no page is truncated by the PostgREST row cap and memory stays bounded
+    by `page_size`.
+    """
+    cursor = None
+    while True:
+        query = (
+            adb()
+            .table("events")
+            .select(columns)
+            .eq("domain", domain)
+            .gte("timestamp", start.isoformat())
+            .lte("timestamp", end.isoformat())
+        )
+        if cursor:
+            session_id, timestamp, id = cursor
+            session_id, timestamp = map(quote_filter_value, (session_id, timestamp))
+            query = query.or_(
+                f"session_id.gt.{session_id},"
+                f"and(session_id.eq.{session_id},timestamp.gt.{timestamp}),"
+                f"and(session_id.eq.{session_id},timestamp.eq.{timestamp},id.gt.{id})"
+            )
+
+        page = (
+            await query.order("session_id")
+            .order("timestamp")
+            .order("id")
+            .limit(page_size)
+            .execute()
+        ).data
+
+        # A short page doesn't mean the end: PostgREST's max-rows setting
+        # may be below page_size. Only an empty page does.
+        if not page:
+            return
+
+        for row in page:
+            yield row
+
+        last = page[-1]
+        cursor = (last["session_id"], last["timestamp"], last["id"])
+
+
+async def group_session_events(
+    events: AsyncIterable[dict],
+) -> AsyncIterator[list[dict]]:
+    """Yield each session's events once its session_id group is complete.
+
+    Expects events ordered by session_id and timestamp, as `scan_events`
+    returns them.
+    """
+    group = []
+    async for event in events:
+        if group and event["session_id"] != group[0]["session_id"]:
+            yield group
+            group = []
+        group.append(event)
+    if group:
+        yield group
+
+
+async def chunked(rows: AsyncIterable, size: int) -> AsyncIterator[list]:
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def build_session(events: list[dict]):
     start = events[0]["timestamp"]
     end = events[-1]["timestamp"]